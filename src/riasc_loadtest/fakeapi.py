@@ -0,0 +1,439 @@
+import asyncio
+import collections
+import copy
+import json
+import socket
+import time
+import uuid
+import jsonpatch
+
+from datetime import datetime, timezone
+from aiohttp import web
+
+# Number of watch events kept per resource for resuming watches
+HISTORY_SIZE = 100000
+
+# Idle watches which allow bookmarks receive one after this interval
+BOOKMARK_INTERVAL = 1.0  # [s]
+
+
+class Resource:
+
+    def __init__(self, group: str, version: str, plural: str, kind: str, namespaced: bool, subresources: list[str] = []):
+        self.group = group
+        self.version = version
+        self.plural = plural
+        self.kind = kind
+        self.namespaced = namespaced
+        self.subresources = subresources
+
+        self.objects: dict[tuple[str, str], dict] = {}
+        self.history = collections.deque(maxlen=HISTORY_SIZE)
+        self.watchers: set[asyncio.Queue] = set()
+
+    @property
+    def api_version(self) -> str:
+        return f'{self.group}/{self.version}' if self.group else self.version
+
+    def to_api_resources(self) -> list[dict]:
+        resources = [{
+            'name': self.plural,
+            'singularName': self.kind.lower(),
+            'namespaced': self.namespaced,
+            'kind': self.kind,
+            'verbs': ['create', 'delete', 'get', 'list', 'patch', 'update', 'watch']
+        }]
+
+        for sub in self.subresources:
+            resources.append({
+                'name': f'{self.plural}/{sub}',
+                'singularName': '',
+                'namespaced': self.namespaced,
+                'kind': self.kind,
+                'verbs': ['get', 'patch', 'update']
+            })
+
+        return resources
+
+
+RESOURCES = [
+    Resource('', 'v1', 'nodes', 'Node', False, ['status']),
+    Resource('', 'v1', 'namespaces', 'Namespace', False, ['status']),
+    Resource('', 'v1', 'configmaps', 'ConfigMap', True),
+    Resource('', 'v1', 'events', 'Event', True),
+    Resource('rbac.authorization.k8s.io', 'v1', 'rolebindings', 'RoleBinding', True),
+    Resource('apps', 'v1', 'daemonsets', 'DaemonSet', True, ['status']),
+    Resource('apiextensions.k8s.io', 'v1', 'customresourcedefinitions', 'CustomResourceDefinition', False, ['status']),
+    Resource('riasc.eu', 'v1', 'projects', 'Project', False),
+    Resource('riasc.eu', 'v1', 'timesyncconfigs', 'TimeSyncConfig', False),
+    Resource('riasc.eu', 'v1', 'schedulerconfigs', 'SchedulerConfig', True),
+    Resource('device.riasc.eu', 'v1', 'chroma4qs', 'Chroma4Q', False),
+    Resource('device.riasc.eu', 'v1', 'chroma4qgroups', 'Chroma4QGroup', False),
+]
+
+
+def merge_patch(target, patch):
+    """ Applies a JSON merge patch (RFC 7386) """
+
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+
+    if not isinstance(target, dict):
+        target = {}
+
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        else:
+            target[key] = merge_patch(target.get(key), value)
+
+    return target
+
+
+class Conflict(Exception):
+    pass
+
+
+class NotFound(Exception):
+    pass
+
+
+class BadRequest(Exception):
+    pass
+
+
+class FakeApiServer:
+    """ An in-memory stand-in for the Kubernetes API server.
+
+        Supports the verbs used by the operator and kopf (list, watch, get,
+        create, patch, delete) for a fixed set of resources, including
+        finalizers and the status subresource. All requests are counted
+        per verb and resource. """
+
+    def __init__(self, resources: list[Resource] = RESOURCES):
+        self.resources = {(res.group, res.plural): res for res in resources}
+        self.revision = 0
+
+        self.requests = collections.Counter()
+        self.last_write = time.monotonic()
+
+        self.app = web.Application(middlewares=[self.handle_errors])
+        self.app.router.add_get('/version', self.handle_version)
+        self.app.router.add_get('/api', self.handle_core_versions)
+        self.app.router.add_get('/apis', self.handle_groups)
+        self.app.router.add_get('/api/{version}', self.handle_resource_list)
+        self.app.router.add_get('/apis/{group}/{version}', self.handle_resource_list)
+        self.app.router.add_route('*', '/api/{version}/{path:.+}', self.handle_object)
+        self.app.router.add_route('*', '/apis/{group}/{version}/{path:.+}', self.handle_object)
+
+        self.runner = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind((host, port))
+        _, port = sock.getsockname()
+
+        site = web.SockSite(self.runner, sock)
+        await site.start()
+
+        return f'http://{host}:{port}'
+
+    async def stop(self):
+        for res in self.resources.values():
+            for queue in res.watchers:
+                queue.put_nowait(None)
+
+        if self.runner:
+            await self.runner.cleanup()
+
+    def resource(self, group: str, plural: str) -> Resource:
+        try:
+            return self.resources[(group, plural)]
+        except KeyError:
+            raise NotFound(f'Unknown resource {plural}.{group}')
+
+    # Direct access to the store (used by the harness to seed & inspect the fleet)
+
+    def get(self, group: str, plural: str, name: str, namespace: str = None) -> dict | None:
+        return self.resource(group, plural).objects.get((namespace, name))
+
+    def list(self, group: str, plural: str, namespace: str = None) -> list[dict]:
+        res = self.resource(group, plural)
+        return [obj for (ns, _), obj in res.objects.items() if namespace is None or ns == namespace]
+
+    def create(self, group: str, plural: str, obj: dict, namespace: str = None) -> dict:
+        res = self.resource(group, plural)
+        obj = copy.deepcopy(obj)
+
+        meta = obj.setdefault('metadata', {})
+        if 'name' not in meta and 'generateName' in meta:
+            meta['name'] = meta['generateName'] + uuid.uuid4().hex[:5]
+
+        if res.namespaced:
+            meta['namespace'] = namespace or meta.get('namespace') or 'default'
+
+        key = (meta.get('namespace'), meta['name'])
+        if key in res.objects:
+            raise Conflict(f'{res.plural} "{meta["name"]}" already exists')
+
+        obj['apiVersion'] = res.api_version
+        obj['kind'] = res.kind
+
+        meta.update({
+            'uid': str(uuid.uuid4()),
+            'generation': 1,
+            'creationTimestamp': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        })
+
+        res.objects[key] = obj
+        self.notify(res, 'ADDED', obj)
+
+        return obj
+
+    def patch(self, group: str, plural: str, name: str, patch, namespace: str = None,
+              content_type: str = 'application/merge-patch+json', subresource: str = None) -> dict:
+        res = self.resource(group, plural)
+
+        key = (namespace if res.namespaced else None, name)
+        obj = res.objects.get(key)
+        if obj is None:
+            raise NotFound(f'{res.plural} "{name}" not found')
+
+        if subresource == 'status':
+            patch = {'status': patch.get('status')} if isinstance(patch, dict) else patch
+
+        if content_type == 'application/json-patch+json':
+            if not isinstance(patch, list):
+                raise BadRequest('json: cannot unmarshal object into Go value of type jsonpatch.Patch')
+
+            try:
+                patched = jsonpatch.apply_patch(obj, patch)
+            except (jsonpatch.JsonPatchConflict, jsonpatch.JsonPatchTestFailed) as e:
+                raise Conflict(str(e))
+        else:
+            # Strategic merge patches are treated as merge patches
+            patched = merge_patch(copy.deepcopy(obj), patch)
+
+        if patched.get('spec') != obj.get('spec'):
+            patched['metadata']['generation'] = obj['metadata'].get('generation', 1) + 1
+
+        meta = patched['metadata']
+        if meta.get('deletionTimestamp') and not meta.get('finalizers'):
+            del res.objects[key]
+            self.notify(res, 'DELETED', patched)
+        else:
+            res.objects[key] = patched
+            self.notify(res, 'MODIFIED', patched)
+
+        return patched
+
+    def delete(self, group: str, plural: str, name: str, namespace: str = None) -> dict:
+        res = self.resource(group, plural)
+
+        key = (namespace if res.namespaced else None, name)
+        obj = res.objects.get(key)
+        if obj is None:
+            raise NotFound(f'{res.plural} "{name}" not found')
+
+        meta = obj['metadata']
+        if meta.get('finalizers'):
+            if not meta.get('deletionTimestamp'):
+                meta['deletionTimestamp'] = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+                self.notify(res, 'MODIFIED', obj)
+        else:
+            del res.objects[key]
+            self.notify(res, 'DELETED', obj)
+
+        return obj
+
+    def notify(self, res: Resource, type: str, obj: dict):
+        self.revision += 1
+        self.last_write = time.monotonic()
+
+        obj['metadata']['resourceVersion'] = str(self.revision)
+
+        event = (self.revision, type, copy.deepcopy(obj))
+        res.history.append(event)
+
+        for queue in res.watchers:
+            queue.put_nowait(event)
+
+    # HTTP handlers
+
+    @web.middleware
+    async def handle_errors(self, request: web.Request, handler):
+        try:
+            return await handler(request)
+        except NotFound as e:
+            return self.status(404, 'NotFound', str(e))
+        except Conflict as e:
+            return self.status(409 if request.method == 'POST' else 422, 'Conflict', str(e))
+        except BadRequest as e:
+            return self.status(400, 'BadRequest', str(e))
+
+    def status(self, code: int, reason: str, message: str) -> web.Response:
+        return web.json_response({
+            'kind': 'Status',
+            'apiVersion': 'v1',
+            'status': 'Failure',
+            'reason': reason,
+            'message': message,
+            'code': code
+        }, status=code)
+
+    async def handle_version(self, request: web.Request):
+        return web.json_response({
+            'major': '1',
+            'minor': '29',
+            'gitVersion': 'v1.29.0-riasc-loadtest'
+        })
+
+    async def handle_core_versions(self, request: web.Request):
+        return web.json_response({
+            'kind': 'APIVersions',
+            'versions': ['v1']
+        })
+
+    async def handle_groups(self, request: web.Request):
+        groups = sorted({(res.group, res.version) for res in self.resources.values() if res.group})
+
+        return web.json_response({
+            'kind': 'APIGroupList',
+            'apiVersion': 'v1',
+            'groups': [{
+                'name': group,
+                'versions': [{'groupVersion': f'{group}/{version}', 'version': version}],
+                'preferredVersion': {'groupVersion': f'{group}/{version}', 'version': version}
+            } for group, version in groups]
+        })
+
+    async def handle_resource_list(self, request: web.Request):
+        group = request.match_info.get('group', '')
+        version = request.match_info['version']
+
+        resources = [res for res in self.resources.values() if res.group == group and res.version == version]
+        if not resources:
+            raise NotFound(f'Unknown group version {group}/{version}')
+
+        return web.json_response({
+            'kind': 'APIResourceList',
+            'apiVersion': 'v1',
+            'groupVersion': f'{group}/{version}' if group else version,
+            'resources': [api_res for res in resources for api_res in res.to_api_resources()]
+        })
+
+    async def handle_object(self, request: web.Request):
+        group = request.match_info.get('group', '')
+        segments = request.match_info['path'].split('/')
+
+        namespace = None
+        if segments[0] == 'namespaces' and len(segments) >= 3 and (group, segments[2]) in self.resources:
+            namespace = segments[1]
+            segments = segments[2:]
+
+        plural, name, subresource = (segments + [None, None])[:3]
+        res = self.resource(group, plural)
+
+        if request.method == 'GET' and name is None:
+            if request.query.get('watch', '').lower() in ['true', '1']:
+                self.requests['watch', plural] += 1
+                return await self.watch(request, res, namespace)
+
+            self.requests['list', plural] += 1
+            return web.json_response({
+                'kind': f'{res.kind}List',
+                'apiVersion': res.api_version,
+                'metadata': {'resourceVersion': str(self.revision)},
+                'items': self.list(group, plural, namespace)
+            })
+
+        if request.method == 'POST' and name is None:
+            self.requests['create', plural] += 1
+            obj = self.create(group, plural, await request.json(), namespace)
+            return web.json_response(obj, status=201)
+
+        if request.method == 'GET':
+            self.requests['get', plural] += 1
+            obj = self.get(group, plural, name, namespace if res.namespaced else None)
+            if obj is None:
+                raise NotFound(f'{plural} "{name}" not found')
+
+            return web.json_response(obj)
+
+        if request.method == 'PATCH':
+            self.requests['patch', plural] += 1
+            obj = self.patch(group, plural, name, await request.json(), namespace,
+                             content_type=request.content_type,
+                             subresource=subresource)
+            return web.json_response(obj)
+
+        if request.method == 'DELETE':
+            self.requests['delete', plural] += 1
+            obj = self.delete(group, plural, name, namespace)
+            return web.json_response(obj)
+
+        raise web.HTTPMethodNotAllowed(request.method, ['GET', 'POST', 'PATCH', 'DELETE'])
+
+    async def watch(self, request: web.Request, res: Resource, namespace: str | None):
+        since = int(request.query.get('resourceVersion') or self.revision)
+        timeout = float(request.query.get('timeoutSeconds', 0)) or None
+        bookmarks = request.query.get('allowWatchBookmarks', '').lower() in ['true', '1']
+
+        queue = asyncio.Queue()
+
+        # Replay events which happened after the requested revision
+        if res.history and since < res.history[0][0] - 1 and len(res.history) == res.history.maxlen:
+            return self.status(410, 'Expired', 'too old resource version')
+
+        for event in res.history:
+            if event[0] > since:
+                queue.put_nowait(event)
+
+        res.watchers.add(queue)
+
+        rsp = web.StreamResponse(headers={'Content-Type': 'application/json'})
+
+        try:
+            await rsp.prepare(request)
+
+            deadline = time.monotonic() + timeout if timeout else None
+            while True:
+                remaining = deadline - time.monotonic() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    break
+
+                wait = min(remaining or BOOKMARK_INTERVAL, BOOKMARK_INTERVAL) if bookmarks else remaining
+
+                try:
+                    event = await asyncio.wait_for(queue.get(), wait)
+                except asyncio.TimeoutError:
+                    if bookmarks:
+                        await rsp.write(json.dumps({
+                            'type': 'BOOKMARK',
+                            'object': {
+                                'apiVersion': res.api_version,
+                                'kind': res.kind,
+                                'metadata': {'resourceVersion': str(self.revision)}
+                            }
+                        }).encode() + b'\n')
+                        continue
+
+                    break
+
+                if event is None:
+                    break
+
+                _, type, obj = event
+                if namespace is not None and obj['metadata'].get('namespace') != namespace:
+                    continue
+
+                await rsp.write(json.dumps({'type': type, 'object': obj}).encode() + b'\n')
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            res.watchers.discard(queue)
+
+        return rsp
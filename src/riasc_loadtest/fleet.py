@@ -0,0 +1,157 @@
+import random
+
+from riasc_loadtest.fakeapi import FakeApiServer
+
+PROJECT_LABEL_PREFIX = 'project.riasc.eu/'
+OPERATOR_NAMESPACE = 'riasc-system'
+
+
+class Fleet:
+    """ A synthetic fleet of nodes, projects and time-sync configs.
+
+        Keeps track of the desired state so that the harness can check
+        whether the operator has converged. """
+
+    def __init__(self, api: FakeApiServer, seed: int = 0):
+        self.api = api
+        self.random = random.Random(seed)
+
+        self.nodes: list[str] = []
+        self.projects: dict[str, dict] = {}
+        self.time_syncs: dict[str, dict] = {}
+
+        self.project_counter = 0
+
+    def add_nodes(self, count: int):
+        for i in range(len(self.nodes), len(self.nodes) + count):
+            name = f'node-{i:05d}'
+
+            self.api.create('', 'nodes', {
+                'metadata': {
+                    'name': name,
+                    'labels': {
+                        'kubernetes.io/hostname': name,
+                        'riasc.eu/lab': f'lab-{i % 10}'
+                    }
+                }
+            })
+
+            self.nodes.append(name)
+
+    def project_spec(self, nodes_per_project: int, users_per_project: int) -> dict:
+        return {
+            'nodes': self.random.sample(self.nodes, min(nodes_per_project, len(self.nodes))),
+            'users': [f'user-{self.random.randrange(10000):04d}' for _ in range(users_per_project)]
+        }
+
+    def add_project(self, spec: dict) -> str:
+        name = f'project-{self.project_counter:04d}'
+        self.project_counter += 1
+
+        self.api.create('riasc.eu', 'projects', {
+            'metadata': {
+                'name': name
+            },
+            'spec': spec
+        })
+
+        self.projects[name] = spec
+
+        return name
+
+    def add_projects(self, count: int, nodes_per_project: int, users_per_project: int):
+        for _ in range(count):
+            self.add_project(self.project_spec(nodes_per_project, users_per_project))
+
+    def add_time_syncs(self, count: int):
+        for i in range(len(self.time_syncs), len(self.time_syncs) + count):
+            name = f'time-sync-{i:03d}'
+            spec = {
+                'nodeSelector': {
+                    'riasc.eu/lab': f'lab-{i % 10}'
+                },
+                'ntp': {
+                    'servers': [{'type': 'server', 'address': f'ntp-{i}.example.com'}],
+                    'server': {'enabled': False, 'allow': [], 'deny': []}
+                },
+                'gps': {'enabled': False},
+                'pps': {'enabled': False},
+                'ptp': {'enabled': False},
+                'chrony': {'extraConfig': ''}
+            }
+
+            self.api.create('riasc.eu', 'timesyncconfigs', {
+                'metadata': {
+                    'name': name
+                },
+                'spec': spec
+            })
+
+            self.time_syncs[name] = spec
+
+    def churn(self, count: int, nodes_per_project: int, users_per_project: int):
+        """ Applies random changes to the projects of the fleet
+
+            Projects changed during this round are not deleted in the same
+            round, as the operator only unlabels the nodes of the latest
+            handled spec when an update is interrupted by a deletion. """
+
+        changed = set()
+
+        for _ in range(count):
+            op = self.random.choice(['nodes', 'users', 'create', 'delete'])
+
+            candidates = sorted(set(self.projects) - changed) if op == 'delete' else sorted(self.projects)
+            if op == 'create' or not candidates:
+                changed.add(self.add_project(self.project_spec(nodes_per_project, users_per_project)))
+                continue
+
+            name = self.random.choice(candidates)
+            spec = self.projects[name]
+            changed.add(name)
+
+            if op == 'delete':
+                self.api.delete('riasc.eu', 'projects', name)
+                del self.projects[name]
+            elif op == 'nodes':
+                nodes = spec['nodes'][1:] + [self.random.choice(self.nodes)]
+                spec = {**spec, 'nodes': list(dict.fromkeys(nodes))}
+            elif op == 'users':
+                users = spec['users'][1:] + [f'user-{self.random.randrange(10000):04d}']
+                spec = {**spec, 'users': list(dict.fromkeys(users))}
+
+            if op != 'delete':
+                self.api.patch('riasc.eu', 'projects', name, {'spec': spec})
+                self.projects[name] = spec
+
+    def pending(self) -> int:
+        """ Returns the number of desired objects which are not yet reconciled """
+
+        pending = 0
+
+        expected_labels = {node: set() for node in self.nodes}
+        for name, spec in self.projects.items():
+            for node in spec['nodes']:
+                expected_labels[node].add(PROJECT_LABEL_PREFIX + name)
+
+            if self.api.get('', 'namespaces', name) is None:
+                pending += 1
+
+            for user in spec['users']:
+                if self.api.get('rbac.authorization.k8s.io', 'rolebindings', f'admin-{user}', name) is None:
+                    pending += 1
+
+        for node, expected in expected_labels.items():
+            labels = self.api.get('', 'nodes', node)['metadata'].get('labels', {})
+            actual = {key for key in labels if key.startswith(PROJECT_LABEL_PREFIX)}
+            if actual != expected:
+                pending += 1
+
+        for name in self.time_syncs:
+            if self.api.get('', 'configmaps', f'time-sync-{name}', OPERATOR_NAMESPACE) is None:
+                pending += 1
+
+            if self.api.get('apps', 'daemonsets', f'time-sync-{name}', OPERATOR_NAMESPACE) is None:
+                pending += 1
+
+        return pending
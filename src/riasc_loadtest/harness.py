@@ -0,0 +1,224 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from riasc_loadtest.fakeapi import FakeApiServer
+from riasc_loadtest.fleet import Fleet
+
+POLL_INTERVAL = 0.5  # [s]
+
+OPERATOR_COMMAND = [
+    sys.executable, '-c', 'from riasc_operator.operator import main; main()'
+]
+
+KUBECONFIG_TEMPLATE = '''
+apiVersion: v1
+kind: Config
+clusters:
+- name: loadtest
+  cluster:
+    server: {server}
+users:
+- name: loadtest
+  user:
+    token: loadtest
+contexts:
+- name: loadtest
+  context:
+    cluster: loadtest
+    user: loadtest
+    namespace: default
+current-context: loadtest
+'''
+
+
+def read_memory(pid: int) -> dict:
+    """ Returns the current and peak resident set size of a process in [kB] """
+
+    mem = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ['VmRSS', 'VmHWM']:
+                mem[key] = int(value.split()[0])
+
+    return {
+        'rss_kb': mem.get('VmRSS'),
+        'peak_rss_kb': mem.get('VmHWM')
+    }
+
+
+class Operator:
+    """ Runs the operator in a subprocess against the fake API server """
+
+    def __init__(self, kubeconfig: str, log: str):
+        self.kubeconfig = kubeconfig
+        self.log = log
+        self.proc = None
+
+    def start(self):
+        env = {
+            **os.environ,
+            'KUBECONFIG': self.kubeconfig,
+            'ENV': 'production',
+            'ADMISSION_ADDR': '127.0.0.1',
+            'ADMISSION_INSECURE': 'true',
+            'POD_NAMESPACE': 'riasc-system'
+        }
+
+        with open(self.log, 'a') as log:
+            self.proc = subprocess.Popen(OPERATOR_COMMAND, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    async def stop(self, timeout: float = 30):
+        if self.proc is None:
+            return
+
+        self.proc.send_signal(signal.SIGTERM)
+
+        deadline = time.monotonic() + timeout
+        while self.proc.poll() is None:
+            if time.monotonic() > deadline:
+                self.proc.kill()
+
+            await asyncio.sleep(0.1)
+
+        self.proc = None
+
+
+async def converge(name: str, api: FakeApiServer, fleet: Fleet, operator: Operator,
+                   objects: int, quiet: float, timeout: float) -> dict:
+    """ Waits until the desired state of the fleet is reached and
+        no more writes have been observed for the quiet period.
+
+        Every phase is expected to cause writes (creation, changes or
+        resuming handlers), so at least one write is awaited. """
+
+    start = time.monotonic()
+    requests_before = api.requests.copy()
+    peak_rss = 0
+    pending = None
+
+    while True:
+        await asyncio.sleep(POLL_INTERVAL)
+
+        now = time.monotonic()
+        if operator.proc.poll() is not None:
+            raise RuntimeError(f'Operator terminated with exit code {operator.proc.returncode}')
+
+        mem = read_memory(operator.proc.pid)
+        peak_rss = max(peak_rss, mem['rss_kb'] or 0)
+
+        pending = fleet.pending()
+        if pending == 0 and api.last_write > start and now - api.last_write > quiet:
+            converged = api.last_write - start
+            break
+
+        if now - start > timeout:
+            converged = None
+            break
+
+    requests = api.requests - requests_before
+
+    result = {
+        'phase': name,
+        'converged': converged is not None,
+        'time_to_converge_s': converged,
+        'pending': pending,
+        'objects': objects,
+        'throughput_per_s': objects / converged if converged else None,
+        'api_calls': sum(requests.values()),
+        'api_calls_by_verb': {f'{verb} {plural}': count for (verb, plural), count in sorted(requests.items())},
+        'operator_rss_kb': mem['rss_kb'],
+        'operator_peak_rss_kb': max(peak_rss, mem['peak_rss_kb'] or 0)
+    }
+
+    logging.info('Phase %s finished: converged=%s in %s s, pending=%d, api_calls=%d',
+                 name, result['converged'], converged, pending, result['api_calls'])
+
+    return result
+
+
+async def run(args: argparse.Namespace) -> list[dict]:
+    api = FakeApiServer()
+    server = await api.start(port=args.port)
+
+    logging.info('Fake Kubernetes API is listening on %s', server)
+
+    fleet = Fleet(api, seed=args.seed)
+    fleet.add_nodes(args.nodes)
+    fleet.add_projects(args.projects, args.nodes_per_project, args.users_per_project)
+    fleet.add_time_syncs(args.time_syncs)
+
+    workdir = tempfile.mkdtemp(prefix='riasc-loadtest-')
+    kubeconfig = os.path.join(workdir, 'kubeconfig')
+    with open(kubeconfig, 'w') as f:
+        f.write(KUBECONFIG_TEMPLATE.format(server=server))
+
+    log = os.path.join(workdir, 'operator.log')
+    logging.info('Writing operator log to %s', log)
+
+    operator = Operator(kubeconfig, log)
+    results = []
+
+    try:
+        operator.start()
+        results.append(await converge('initial', api, fleet, operator,
+                                      objects=args.projects + args.time_syncs,
+                                      quiet=args.quiet, timeout=args.timeout))
+
+        if args.churn:
+            fleet.churn(args.churn, args.nodes_per_project, args.users_per_project)
+            results.append(await converge('churn', api, fleet, operator,
+                                          objects=args.churn,
+                                          quiet=args.quiet, timeout=args.timeout))
+
+        await operator.stop()
+
+        operator.start()
+        results.append(await converge('restart', api, fleet, operator,
+                                      objects=len(fleet.projects) + len(fleet.time_syncs),
+                                      quiet=args.quiet, timeout=args.timeout))
+    finally:
+        await operator.stop()
+        await api.stop()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the RIasC operator against a fake Kubernetes API')
+    parser.add_argument('--nodes', type=int, default=5000)
+    parser.add_argument('--projects', type=int, default=500)
+    parser.add_argument('--time-syncs', type=int, default=50)
+    parser.add_argument('--nodes-per-project', type=int, default=20)
+    parser.add_argument('--users-per-project', type=int, default=3)
+    parser.add_argument('--churn', type=int, default=100, help='Number of random project changes')
+    parser.add_argument('--quiet', type=float, default=5.0, help='Period without API writes after which the operator is considered converged [s]')
+    parser.add_argument('--timeout', type=float, default=1800.0, help='Maximum duration of each phase [s]')
+    parser.add_argument('--port', type=int, default=0, help='Port of the fake API server')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the report as JSON to this file')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    results = asyncio.run(run(args))
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
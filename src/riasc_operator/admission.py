@@ -0,0 +1,213 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+import ssl
+
+from aiohttp import web
+from kubernetes_asyncio import client, watch
+from kubernetes_asyncio.client.exceptions import ApiException
+
+from riasc_operator.utils.api_client import new_api_client
+from riasc_operator.utils.labels import label_conflicts, project_node_selector
+
+ADMISSION_PORT = int(os.environ.get('ADMISSION_PORT', '443'))
+ADMISSION_CERTFILE = os.environ.get('ADMISSION_CERTFILE')
+ADMISSION_PKEYFILE = os.environ.get('ADMISSION_PKEYFILE')
+
+WATCH_TIMEOUT = 300  # [s]
+RECONNECT_INTERVAL = 5.0  # [s]
+
+logger = logging.getLogger(__name__)
+
+
+class ProjectCache:
+    """ An in-memory copy of the specs of all projects.
+
+        The cache is filled by listing all projects and kept in sync by
+        watching them afterwards. It is ready once the initial list has
+        been received and stays ready when the watch is re-established. """
+
+    def __init__(self):
+        self.projects: dict[str, dict] = {}
+        self.ready = asyncio.Event()
+
+    async def list(self, api: client.CustomObjectsApi) -> str:
+        rsp = await api.list_cluster_custom_object('riasc.eu', 'v1', 'projects')
+
+        self.projects = {
+            obj['metadata']['name']: obj.get('spec', {})
+            for obj in rsp.get('items', [])
+        }
+        self.ready.set()
+
+        logger.info('Listed %d projects', len(self.projects))
+
+        return rsp['metadata']['resourceVersion']
+
+    def handle(self, event: dict) -> str | None:
+        """ Applies a watch event and returns the resource version to resume the watch from """
+
+        obj = event['object']
+        resource_version = obj.get('metadata', {}).get('resourceVersion')
+
+        # Bookmarks only carry the resource version
+        if event['type'] not in ['ADDED', 'MODIFIED', 'DELETED']:
+            return resource_version
+
+        name = obj['metadata']['name']
+
+        if event['type'] == 'DELETED':
+            self.projects.pop(name, None)
+        else:
+            self.projects[name] = obj.get('spec', {})
+
+        return resource_version
+
+    async def run(self, api: client.ApiClient):
+        custom_api = client.CustomObjectsApi(api)
+        resource_version = None
+
+        while True:
+            try:
+                if resource_version is None:
+                    resource_version = await self.list(custom_api)
+
+                w = watch.Watch()
+                async with w.stream(custom_api.list_cluster_custom_object, 'riasc.eu', 'v1', 'projects',
+                                    resource_version=resource_version,
+                                    allow_watch_bookmarks=True,
+                                    timeout_seconds=WATCH_TIMEOUT) as stream:
+                    async for event in stream:
+                        resource_version = self.handle(event) or resource_version
+            except asyncio.CancelledError:
+                raise
+            except ApiException as e:
+                if e.status == 410:
+                    logger.info('Watch expired, listing projects again')
+                else:
+                    logger.warning('Failed to watch projects: %s', e)
+                    await asyncio.sleep(RECONNECT_INTERVAL)
+
+                resource_version = None
+            except Exception as e:
+                logger.warning('Failed to watch projects: %s', e)
+                await asyncio.sleep(RECONNECT_INTERVAL)
+
+                resource_version = None
+
+
+def review_response(uid: str, allowed: bool = True, patch: list[dict] | None = None, message: str | None = None) -> dict:
+    response = {
+        'uid': uid,
+        'allowed': allowed
+    }
+
+    if patch:
+        response['patchType'] = 'JSONPatch'
+        response['patch'] = base64.b64encode(json.dumps(patch).encode()).decode()
+
+    if message is not None:
+        response['status'] = {
+            'message': message,
+            'code': 500
+        }
+
+    return {
+        'apiVersion': 'admission.k8s.io/v1',
+        'kind': 'AdmissionReview',
+        'response': response
+    }
+
+
+def validate_node_selector(projects: dict[str, dict], request: dict) -> dict:
+    """ Enforces the nodeSelector of a project on its pods.
+
+        Behaves like the validate_node_selector handler of the operator. """
+
+    uid = request['uid']
+    namespace = request.get('namespace')
+    pod = request.get('object') or {}
+
+    project = projects.get(namespace)
+    if project is None or not pod:
+        return review_response(uid)
+
+    podNodeSelector = dict(pod.get('spec', {}).get('nodeSelector') or {})
+    projectNodeSelector = project_node_selector(namespace, project)
+
+    if label_conflicts(projectNodeSelector, podNodeSelector):
+        return review_response(uid, allowed=False, message=f'Conflicting nodeSelector for project {namespace}')
+
+    if projectNodeSelector.items() <= podNodeSelector.items():
+        return review_response(uid)
+
+    podNodeSelector.update(projectNodeSelector)
+
+    return review_response(uid, patch=[{
+        'op': 'add',
+        'path': '/spec/nodeSelector',
+        'value': podNodeSelector
+    }])
+
+
+async def handle_validate_node_selector(request: web.Request) -> web.Response:
+    try:
+        review = await request.json()
+        req = review['request']
+    except (ValueError, KeyError, TypeError):
+        raise web.HTTPBadRequest(text='Invalid AdmissionReview')
+
+    cache: ProjectCache = request.app['cache']
+
+    return web.json_response(validate_node_selector(cache.projects, req))
+
+
+async def handle_healthz(request: web.Request) -> web.Response:
+    cache: ProjectCache = request.app['cache']
+    if not cache.ready.is_set():
+        raise web.HTTPServiceUnavailable(text='Projects have not been synced yet')
+
+    return web.Response(text='ok')
+
+
+async def serve():
+    api = await new_api_client()
+
+    cache = ProjectCache()
+    sync = asyncio.create_task(cache.run(api))
+
+    app = web.Application()
+    app['cache'] = cache
+    app.router.add_post('/validate_node_selector', handle_validate_node_selector)
+    app.router.add_get('/healthz', handle_healthz)
+
+    ssl_context = None
+    if ADMISSION_CERTFILE:
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(ADMISSION_CERTFILE, ADMISSION_PKEYFILE)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+
+    site = web.TCPSite(runner, port=ADMISSION_PORT, ssl_context=ssl_context)
+    await site.start()
+
+    logger.info('Admission webhook is listening on port %d (%s)', ADMISSION_PORT, 'https' if ssl_context else 'http')
+
+    try:
+        await sync
+    finally:
+        await runner.cleanup()
+        await api.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import asyncio
+import aiohttp
+import kopf
+
+from kubernetes_asyncio.client.exceptions import ApiException
+
+from riasc_operator.utils.api_client import API_CONNECTION_POOL_SIZE, new_api_client
+
+# Delay before retrying a throttled or failed request if the API server gives no Retry-After
+RETRY_DELAY = 10  # [s]
+
+
+def handler_error(message: str, e: Exception) -> kopf.PermanentError | kopf.TemporaryError:
+    """ Converts the exception of an API call to a kopf error.
+
+        Throttled requests, server errors and connection failures are retried.
+        All other errors fail the handler permanently. """
+
+    if isinstance(e, ApiException) and (e.status == 429 or (e.status or 0) >= 500):
+        retry_after = (e.headers or {}).get('Retry-After', '')
+        delay = int(retry_after) if retry_after.isdigit() else RETRY_DELAY
+
+        return kopf.TemporaryError(f'{message}: {e.status} {e.reason}', delay=delay)
+    elif isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError)):
+        return kopf.TemporaryError(f'{message}: {e}', delay=RETRY_DELAY)
+
+    return kopf.PermanentError(f'{message}: {e}')
+
+
+@kopf.on.startup()
+async def create_api_client(logger: kopf.Logger, memo: kopf.Memo, **_):
+    """ Creates the Kubernetes API client shared by all handlers.
+
+        The per-object memos are copies of the operator memo, so
+        handlers find the client as memo.api """
+
+    memo.api = await new_api_client()
+
+    logger.info('Kubernetes API client connects to %s with up to %d connections',
+                memo.api.configuration.host, API_CONNECTION_POOL_SIZE)
+
+
+@kopf.on.cleanup()
+async def close_api_client(memo: kopf.Memo, **_):
+    api = memo.get('api')
+    if api is not None:
+        await api.close()
@@ -1,8 +1,35 @@
+import asyncio
+import copy
+import threading
 import kopf
 import pyvisa
 import chroma
 import logging
 
+from kubernetes_asyncio import client
+
+# Creates the API client shared by the handlers as memo.api
+import riasc_operator.api  # noqa: F401
+from riasc_operator.devices.profile import Playback, Profile, load_profile
+from riasc_operator.devices.scheduler import scheduler
+
+DEFAULT_ACQUISITION_PERIOD = 5.0  # [s]
+
+# Interval in which the playback daemon checks for a changed profile
+PROFILE_POLL_INTERVAL = 1.0  # [s]
+
+# Connected devices by name, used to address them from other resources
+devices: dict[str, kopf.Memo] = {}
+
+# Changes to the profile are applied by the playback daemon alone
+CONFIG_FIELDS = ['parameters', 'setpoints', 'phases', 'acquisition']
+
+SETPOINT_METHODS = {
+    'frequency': 'set_frequency',
+    'voltageAC': 'set_voltage_AC',
+    'voltageDC': 'set_voltage_DC'
+}
+
 
 def check(params: dict, setp: dict):
     # TODO implement safety checks
@@ -22,10 +49,59 @@ def configure(amp: chroma.amp4Q, params: dict, phases: list[int], setp: dict):
         params.get('maxVoltageDCminus', 0)
     )
 
-    for i in phases:
-        amp.set_frequency(i, setp.get('frequency')[i])
-        amp.set_voltage_AC(i, setp.get('voltageAC')[i])
-        amp.set_voltage_DC(i, setp.get('voltageDC')[i])
+    write_setpoints(amp, [
+        (q, i, setp[q][i]) for i in phases for q in SETPOINT_METHODS if q in setp
+    ])
+
+
+def write_setpoints(amp: chroma.amp4Q, commands: list[tuple[str, int, float]]):
+    """ Writes a list of (quantity, phase, value) setpoints """
+
+    for q, i, value in commands:
+        getattr(amp, SETPOINT_METHODS[q])(i, value)
+
+
+def measure(amp: chroma.amp4Q, lock: threading.Lock, phases: list[int]) -> dict:
+    with lock:
+        return {
+            'frequency':     [amp.meas_frequency(i) for i in phases],
+            'voltageAC':     [amp.meas_voltage_AC(i) for i in phases],
+            'currentAC':     [amp.meas_current_AC(i) for i in phases],
+            'powerReal':     [amp.meas_power_real(i) for i in phases],
+            'powerReactive': [amp.meas_power_reactive(i) for i in phases],
+        }
+
+
+async def patch_status(api: client.ApiClient, name: str, status: dict):
+    custom_api = client.CustomObjectsApi(api)
+
+    # Without an explicit content type, a dict body would be sent as JSON patch
+    await custom_api.patch_cluster_custom_object('device.riasc.eu', 'v1', 'chroma4qs', name, {
+        'status': status
+    }, _content_type='application/merge-patch+json')
+
+
+def static_setpoints(spec: kopf.Spec) -> dict:
+    # A profile takes precedence over the static setpoints
+    return {} if 'profile' in spec else spec.get('setpoints', {})
+
+
+def schedule_measurements(name: str, spec: kopf.Spec, memo: kopf.Memo):
+    phases = list(spec.get('phases', []))
+    period = spec.get('acquisition', {}).get('period', DEFAULT_ACQUISITION_PERIOD)
+
+    async def publish(measurements: dict, acquisition: dict):
+        await patch_status(memo.api, name, {
+            'measurements': measurements,
+            'acquisition': acquisition
+        })
+
+    scheduler.schedule(name, period, lambda: measure(memo.amp, memo.lock, phases), publish)
+
+
+def reconfigure(memo: kopf.Memo, params: dict, phases: list[int], setp: dict):
+    with memo.lock:
+        configure(memo.amp, params, phases, setp)
 
 
 @kopf.on.startup()
@@ -35,10 +111,9 @@ def startup(settings: kopf.OperatorSettings, **_):
 
 @kopf.on.create('device.riasc.eu', 'v1', 'chroma4qs')
 @kopf.on.resume('device.riasc.eu', 'v1', 'chroma4qs')
-def create_or_resume(spec: kopf.Spec, memo: kopf.Memo):
+def create_or_resume(name: str, spec: kopf.Spec, memo: kopf.Memo, **_):
     conn = spec.get('connection')
     params = spec.get('parameters')
-    setp = spec.get('setpoints')
     if params is None or conn is None:
         raise kopf.PermanentError('incomplete settings')
 
@@ -47,32 +122,135 @@ def create_or_resume(spec: kopf.Spec, memo: kopf.Memo):
         conn.get('port'),
         conn.get('timeout'), False)
 
-    configure(memo.amp, params, setp)
+    # Serializes the SCPI commands of the handlers and the acquisition
+    memo.lock = threading.Lock()
+
+    reconfigure(memo, params, spec.get('phases', []), static_setpoints(spec))
+
+    memo.phases = list(spec.get('phases', []))
+    devices[name] = memo
+
+    schedule_measurements(name, spec, memo)
+
 
+def config_changed(diff: kopf.Diff, **_) -> bool:
+    for _, field, _, new in diff:
+        if field[:1] != ('spec',):
+            continue
 
-@kopf.on.update('device.riasc.eu', 'v1', 'chroma4qs')
-def update(spec: kopf.Spec, memo: kopf.Memo):
+        if len(field) == 1 or field[1] in CONFIG_FIELDS:
+            return True
+
+        # The static setpoints are applied again once the profile is removed
+        if field == ('spec', 'profile') and new is None:
+            return True
+
+    return False
+
+
+@kopf.on.update('device.riasc.eu', 'v1', 'chroma4qs', when=config_changed)
+async def update(name: str, spec: kopf.Spec, memo: kopf.Memo, **_):
     params = spec.get('parameters')
     setp = spec.get('setpoints')
-    if params is None or setp is None:
+    if params is None or (setp is None and 'profile' not in spec):
         raise kopf.PermanentError('incomplete settings')
 
-    configure(memo.amp, params, setp)
+    phases = list(spec.get('phases', []))
+
+    # The playback must not write to the old phases or over the static setpoints.
+    # The daemon restarts it with the new phases.
+    if 'profile' not in spec or phases != memo.phases:
+        await stop_playback(memo)
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, reconfigure, memo, params, phases, static_setpoints(spec))
+
+    memo.phases = phases
+
+    schedule_measurements(name, spec, memo)
 
 
 @kopf.on.delete('device.riasc.eu', 'v1', 'chroma4qs')
-def delete(memo: kopf.Memo):
-    memo.amp.disconnect_DUT()
+def delete(name: str, memo: kopf.Memo, **_):
+    scheduler.unschedule(name)
+    devices.pop(name, None)
+
+    with memo.lock:
+        memo.amp.disconnect_DUT()
+
+
+async def play_profile(logger: kopf.Logger, name: str, spec: dict, phases: list[int], memo: kopf.Memo):
+    try:
+        profile = Profile(await load_profile(memo.api, spec))
+    except Exception as e:
+        logger.error('Failed to load profile: %s', e)
+        await patch_status(memo.api, name, {'profile': {'state': 'failed', 'error': str(e)}})
+        return
+
+    def write(commands: list):
+        with memo.lock:
+            # Checked under the lock, as the device might have been reconfigured meanwhile
+            if not playback.stopped:
+                write_setpoints(memo.amp, commands)
+
+    async def publish(status: dict):
+        await patch_status(memo.api, name, {'profile': status})
+
+    playback = Playback(profile, phases, write, publish)
+    memo.playback = playback
+
+    logger.info('Playing profile with %d points from %s', profile.length, playback.status()['start'])
+
+    try:
+        await playback.run()
+    except Exception as e:
+        logger.error('Failed to play profile: %s', e)
+
+        playback.state = 'failed'
+        await playback.report(force=True)
+
+
+def start_playback(logger: kopf.Logger, name: str, spec: dict, phases: list[int], memo: kopf.Memo):
+    memo.playback = None
+    memo.playback_task = asyncio.create_task(play_profile(logger, name, spec, phases, memo))
+
+
+async def stop_playback(memo: kopf.Memo):
+    """ Stops the playback of a profile. No more setpoints are written once this returns. """
+
+    playback = memo.get('playback')
+    if playback is not None:
+        playback.stopped = True
+
+    task = memo.get('playback_task')
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    memo.playback = None
+    memo.playback_task = None
+
+
+@kopf.daemon('device.riasc.eu', 'v1', 'chroma4qs',
+             when=lambda spec, **_: 'profile' in spec,
+             cancellation_timeout=PROFILE_POLL_INTERVAL)
+async def profile(logger: kopf.Logger, name: str, spec: kopf.Spec, memo: kopf.Memo, stopped: kopf.DaemonStopped, **_):
+    """ Plays the setpoint profile and restarts it whenever it or the phases are changed """
+
+    current = None
+
+    try:
+        while not stopped:
+            wanted = (spec.get('profile'), list(spec.get('phases', [])))
 
+            # The device is connected by the create/resume handler.
+            # A removed profile is stopped by the update handler.
+            if 'amp' in memo and wanted[0] is not None and wanted != current:
+                await stop_playback(memo)
 
-@kopf.timer('device.riasc.eu', 'v1', 'chroma4qs', interval=5)
-def measurements(spec: kopf.Spec, memo: kopf.Memo):
-    phases = spec.get('phases')
+                current = copy.deepcopy(wanted)
+                start_playback(logger, name, *current, memo)
 
-    return {
-        'frequency':     [memo.amp.meas_frequency(i) for i in phases],
-        'voltageAC':     [memo.amp.meas_voltage_AC(i) for i in phases],
-        'currentDC':     [memo.amp.meas_current_AC(i) for i in phases],
-        'powerReal':     [memo.amp.meas_power_real(i) for i in phases],
-        'powerReactive': [memo.amp.meas_power_reactive(i) for i in phases],
-    }
+            await asyncio.sleep(PROFILE_POLL_INTERVAL)
+    finally:
+        await stop_playback(memo)
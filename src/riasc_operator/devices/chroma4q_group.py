@@ -0,0 +1,139 @@
+import asyncio
+import concurrent.futures
+import time
+import kopf
+
+from kubernetes_asyncio import client
+
+from riasc_operator.devices.chroma4q import SETPOINT_METHODS, devices, write_setpoints
+from riasc_operator.devices.profile import parse_time, spin_until
+from riasc_operator.devices.scheduler import timestamp
+
+DEFAULT_LEAD_TIME = 1.0  # [s]
+
+# Minimum time between handling a change and applying it,
+# required to start the threads and stage the commands
+MIN_LEAD_TIME = 0.1  # [s]
+
+# The lock of a device is taken this long before the setpoints are applied,
+# so that a running acquisition does not delay the change
+LOCK_ADVANCE = 0.05  # [s]
+
+# Interval for retrying if some of the devices are not connected yet
+RETRY_DELAY = 5  # [s]
+
+
+def stage(name: str, spec: kopf.Spec) -> tuple[kopf.Memo, list[tuple[str, int, float]]]:
+    """ Prepares the commands for applying the setpoints of a group to one of its devices """
+
+    device = devices.get(name)
+    if device is None:
+        raise kopf.TemporaryError(f'Device {name} is not connected', delay=RETRY_DELAY)
+
+    setp = spec.get('setpoints', {})
+
+    try:
+        commands = [
+            (q, i, setp[q][i]) for i in device.phases for q in SETPOINT_METHODS if q in setp
+        ]
+    except IndexError:
+        raise kopf.PermanentError(f'Setpoints do not cover all phases of device {name}')
+
+    return device, commands
+
+
+async def check_profiles(api: client.ApiClient, names: list[str]):
+    """ Rejects devices which play a profile.
+
+        The next point of the profile would overwrite the setpoints of the
+        group, and the playback would not rewrite setpoints it considers
+        unchanged, so the device would drift from its profile. """
+
+    custom_api = client.CustomObjectsApi(api)
+
+    objs = await asyncio.gather(*[
+        custom_api.get_cluster_custom_object('device.riasc.eu', 'v1', 'chroma4qs', name)
+        for name in names
+    ])
+
+    playing = [obj['metadata']['name'] for obj in objs if 'profile' in obj.get('spec', {})]
+    if playing:
+        raise kopf.PermanentError(f'Devices play a profile: {", ".join(playing)}')
+
+
+def apply(device: kopf.Memo, commands: list, deadline: float) -> dict:
+    """ Writes the staged commands to a device at the deadline. Runs in its own thread. """
+
+    spin_until(deadline - LOCK_ADVANCE)
+
+    try:
+        with device.lock:
+            spin_until(deadline)
+
+            start = time.time()
+            write_setpoints(device.amp, commands)
+            end = time.time()
+    except Exception as e:
+        return {
+            'error': str(e)
+        }
+
+    return {
+        'actual': timestamp(start),
+        'skew': start - deadline,
+        'duration': end - start,
+        'writes': len(commands)
+    }
+
+
+@kopf.on.create('device.riasc.eu', 'v1', 'chroma4qgroups')
+@kopf.on.update('device.riasc.eu', 'v1', 'chroma4qgroups', field='spec')
+async def apply_group(logger: kopf.Logger, spec: kopf.Spec, patch: kopf.Patch, memo: kopf.Memo, **_):
+    """ Applies the setpoints of a group to all its devices at the same instant.
+
+        The commands for all devices are staged before the shared deadline.
+        One thread per device then waits for the deadline and writes them,
+        relying on the time sync of the nodes for alignment. """
+
+    names = list(spec.get('devices', []))
+    if not names:
+        raise kopf.PermanentError('Group has no devices')
+
+    staged = {name: stage(name, spec) for name in names}
+
+    await check_profiles(memo.api, names)
+
+    now = time.time()
+    if 'applyAt' in spec:
+        deadline = parse_time(spec['applyAt'])
+        if deadline - now < MIN_LEAD_TIME:
+            raise kopf.PermanentError(f'applyAt {spec["applyAt"]} is not far enough in the future')
+    else:
+        deadline = now + max(spec.get('leadTime', DEFAULT_LEAD_TIME), MIN_LEAD_TIME)
+
+    logger.info('Applying setpoints to %d devices at %s', len(names), timestamp(deadline))
+
+    loop = asyncio.get_running_loop()
+
+    with concurrent.futures.ThreadPoolExecutor(len(names), thread_name_prefix='group') as executor:
+        results = await asyncio.gather(*[
+            loop.run_in_executor(executor, apply, device, commands, deadline)
+            for device, commands in staged.values()
+        ])
+
+    results = dict(zip(staged, results))
+
+    skews = [result['skew'] for result in results.values() if 'skew' in result]
+    failed = [name for name, result in results.items() if 'error' in result]
+
+    patch.status['applied'] = {
+        'planned': timestamp(deadline),
+        'devices': results,
+        'maxSkew': max(skews) if skews else None,
+        'spread': max(skews) - min(skews) if skews else None
+    }
+
+    if failed:
+        raise kopf.PermanentError(f'Failed to apply setpoints to: {", ".join(failed)}')
+
+    logger.info('Applied setpoints with a spread of %.6f s', max(skews) - min(skews))
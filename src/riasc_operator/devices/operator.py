@@ -0,0 +1,27 @@
+import kopf
+
+import riasc_operator.api  # noqa: F401
+import riasc_operator.events  # noqa: F401
+import riasc_operator.profiling  # noqa: F401
+import riasc_operator.devices.chroma4q  # noqa: F401
+import riasc_operator.devices.chroma4q_group  # noqa: F401
+
+
+def main():
+    """ Runs the controllers of the lab devices.
+
+        They run separately from riasc-operator, as they need network access
+        to the devices and keep them connected. Groups address the devices
+        via the registry of the Chroma4Q controller, so both must run in
+        the same process. """
+
+    kopf.configure(
+        verbose=True
+    )
+
+    # The devices are not handled by riasc-operator, so there is no need to pause for its peers
+    kopf.run(
+        clusterwide=True,
+        standalone=True,
+        liveness_endpoint='http://0.0.0.0:8080/healthz'
+    )
@@ -0,0 +1,266 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import time
+import kopf
+
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from kubernetes_asyncio import client
+
+from riasc_operator.devices.scheduler import next_deadline, timestamp
+
+NAMESPACE = os.environ.get('POD_NAMESPACE', 'riasc-system')
+
+# Number of devices which can play back a profile concurrently
+PLAYBACK_WORKERS = int(os.environ.get('PLAYBACK_WORKERS', '8'))
+
+# A write is handed over to its worker this long before its deadline
+WAKEUP_ADVANCE = 0.01  # [s]
+
+# Workers sleep until this long before the deadline and busy-wait for the rest
+SPIN_THRESHOLD = 0.002  # [s]
+
+# Delay between loading a profile and its first point if no start time is given
+START_DELAY = 1.0  # [s]
+
+STATUS_INTERVAL = 5.0  # [s]
+RECENT_POINTS = 10
+
+QUANTITIES = ['frequency', 'voltageAC', 'voltageDC']
+
+executor = concurrent.futures.ThreadPoolExecutor(PLAYBACK_WORKERS, thread_name_prefix='playback')
+
+logger = logging.getLogger(__name__)
+
+
+def spin_until(deadline: float):
+    """ Waits for a wall-clock instant with a precision well below the scheduler tick """
+
+    delay = deadline - SPIN_THRESHOLD - time.time()
+    if delay > 0:
+        time.sleep(delay)
+
+    while time.time() < deadline:
+        time.sleep(0)  # yields the GIL
+
+
+def parse_time(value: str) -> float:
+    # Python < 3.11 does not accept a trailing Z
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+async def load_profile(api: client.ApiClient, spec: dict) -> dict:
+    """ Returns the profile of a spec, merged with the profile stored in a ConfigMap """
+
+    ref = spec.get('configMapRef')
+    if ref is None:
+        return spec
+
+    core_api = client.CoreV1Api(api)
+
+    cm = await core_api.read_namespaced_config_map(ref['name'], ref.get('namespace', NAMESPACE))
+    key = ref.get('key', 'profile.json')
+
+    try:
+        stored = json.loads((cm.data or {})[key])
+    except (KeyError, ValueError) as e:
+        raise kopf.PermanentError(f'Invalid profile in ConfigMap {ref["name"]}: {e}')
+
+    return {**stored, **{k: v for k, v in spec.items() if k != 'configMapRef'}}
+
+
+class Profile:
+    """ A time series of per-phase setpoints.
+
+        The setpoints of each quantity are given as a list of points, each
+        holding the values of all phases like the static setpoints. The
+        points are either equidistant or at explicit offsets from the start. """
+
+    def __init__(self, spec: dict):
+        setpoints = spec.get('setpoints', {})
+
+        self.setpoints = {q: setpoints[q] for q in QUANTITIES if q in setpoints}
+        if not self.setpoints:
+            raise kopf.PermanentError('Profile has no setpoints')
+
+        lengths = {len(points) for points in self.setpoints.values()}
+        if len(lengths) != 1:
+            raise kopf.PermanentError('All setpoints of a profile must have the same number of points')
+
+        self.length = lengths.pop()
+        self.interval = spec.get('interval')
+        self.repeat = spec.get('repeat', False)
+
+        times = spec.get('times')
+        if times is not None:
+            if len(times) != self.length:
+                raise kopf.PermanentError('Profile must have a time for every point')
+            if any(b < a for a, b in zip(times, times[1:])):
+                raise kopf.PermanentError('Profile times must be ascending')
+
+            self.offsets = list(times)
+        elif self.interval:
+            self.offsets = [k * self.interval for k in range(self.length)]
+        else:
+            raise kopf.PermanentError('Profile requires either an interval or times')
+
+        if self.repeat and not self.interval:
+            raise kopf.PermanentError('Repeated profiles require an interval')
+
+        # Duration of a single cycle of a repeated profile
+        self.cycle = self.offsets[-1] + (self.interval or 0)
+
+        if 'start' in spec:
+            self.start = parse_time(spec['start'])
+        else:
+            self.start = next_deadline(self.interval or 1.0, time.time() + START_DELAY)
+
+    def deadline(self, n: int) -> float:
+        """ Returns the deadline of the n-th point of the playback """
+
+        cycle, index = divmod(n, self.length)
+        return self.start + cycle * self.cycle + self.offsets[index]
+
+    def count(self) -> int | None:
+        return None if self.repeat else self.length
+
+    def values(self, n: int) -> dict[str, list]:
+        index = n % self.length
+        return {q: points[index] for q, points in self.setpoints.items()}
+
+
+def delta(values: dict[str, list], phases: list[int], applied: dict[tuple[str, int], float]) -> list[tuple[str, int, float]]:
+    """ Returns the commands for the setpoints which differ from the applied ones """
+
+    commands = []
+    for q, setpoints in values.items():
+        for i in phases:
+            value = setpoints[i]
+            if applied.get((q, i)) != value:
+                commands.append((q, i, value))
+
+    return commands
+
+
+class Playback:
+    """ Applies the points of a profile to a device at their deadlines.
+
+        Only setpoints which changed since the previous point are written.
+        The commands of each point are prepared before the deadline and
+        written by a single worker call, which waits for the exact instant.
+        Points whose deadlines have passed are skipped, except for the
+        latest one. """
+
+    def __init__(self, profile: Profile, phases: list[int],
+                 write: Callable[[list[tuple[str, int, float]]], None],
+                 publish: Callable[[dict], Awaitable]):
+        self.profile = profile
+        self.phases = phases
+        self.write = write
+        self.publish = publish
+
+        self.applied: dict[tuple[str, int], float] = {}
+
+        # Set when the playback is stopped, so that the writer can drop writes
+        # which have already been handed over to a worker
+        self.stopped = False
+
+        self.state = 'waiting'
+        self.points = 0
+        self.writes = 0
+        self.skipped = 0
+        self.lateness_sum = 0.0
+        self.lateness_max = 0.0
+        self.recent = []
+        self.last_publish = 0.0
+
+    def status(self) -> dict:
+        return {
+            'state': self.state,
+            'start': timestamp(self.profile.start),
+            'length': self.profile.length,
+            'points': self.points,
+            'writes': self.writes,
+            'skipped': self.skipped,
+            'meanLateness': self.lateness_sum / self.points if self.points else None,
+            'maxLateness': self.lateness_max,
+            'recent': self.recent
+        }
+
+    def apply(self, deadline: float, commands: list) -> tuple[float, float]:
+        """ Waits for the deadline and writes the commands. Runs in a worker thread. """
+
+        spin_until(deadline)
+
+        start = time.time()
+        self.write(commands)
+        end = time.time()
+
+        return start, end
+
+    async def report(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.last_publish < STATUS_INTERVAL:
+            return
+
+        self.last_publish = now
+
+        try:
+            await self.publish(self.status())
+        except Exception as e:
+            logger.error('Failed to publish profile status: %s', e)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        count = self.profile.count()
+
+        await self.report(force=True)
+
+        n = 0
+        while count is None or n < count:
+            # Skip all points whose successor is already due
+            now = time.time()
+            while (count is None or n + 1 < count) and self.profile.deadline(n + 1) <= now:
+                n += 1
+                self.skipped += 1
+
+            deadline = self.profile.deadline(n)
+
+            commands = delta(self.profile.values(n), self.phases, self.applied)
+
+            delay = deadline - WAKEUP_ADVANCE - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            self.state = 'running'
+
+            start, end = await loop.run_in_executor(executor, self.apply, deadline, commands)
+
+            for q, i, value in commands:
+                self.applied[q, i] = value
+
+            lateness = start - deadline
+
+            self.points += 1
+            self.writes += len(commands)
+            self.lateness_sum += lateness
+            self.lateness_max = max(self.lateness_max, lateness)
+
+            self.recent = self.recent[-(RECENT_POINTS - 1):] + [{
+                'index': n % self.profile.length,
+                'planned': timestamp(deadline),
+                'actual': timestamp(start),
+                'duration': end - start,
+                'writes': len(commands)
+            }]
+
+            await self.report()
+
+            n += 1
+
+        self.state = 'finished'
+        await self.report(force=True)
@@ -0,0 +1,256 @@
+import asyncio
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+import kopf
+
+from datetime import datetime, timezone
+from typing import Awaitable, Callable
+
+# Number of devices which can be sampled concurrently
+ACQUISITION_WORKERS = int(os.environ.get('ACQUISITION_WORKERS', '16'))
+
+# The scheduler hands over an acquisition to its worker this long before
+# the deadline. The worker then waits for the exact deadline by itself.
+WAKEUP_ADVANCE = 0.005  # [s]
+
+logger = logging.getLogger(__name__)
+
+
+def next_deadline(period: float, now: float) -> float:
+    """ Returns the next multiple of the period after now.
+
+        As the deadlines are multiples of the Unix time, devices with the
+        same period are sampled at the same instants. """
+
+    return math.ceil(now / period) * period
+
+
+def timestamp(t: float) -> str:
+    return datetime.fromtimestamp(t, timezone.utc).isoformat(timespec='microseconds')
+
+
+class Job:
+    """ A periodic acquisition of a single device """
+
+    def __init__(self, key: str, period: float,
+                 acquire: Callable[[], dict],
+                 publish: Callable[[dict, dict], Awaitable]):
+        self.key = key
+        self.period = period
+        self.acquire = acquire
+        self.publish = publish
+
+        self.busy = False
+        self.cancelled = False
+
+        self.samples = 0
+        self.overruns = 0
+        self.missed = 0
+        self.errors = 0
+        self.last_duration = None
+        self.max_duration = 0.0
+        self.last_lateness = None
+        self.max_lateness = 0.0
+
+    def statistics(self) -> dict:
+        return {
+            'period': self.period,
+            'samples': self.samples,
+            'overruns': self.overruns,
+            'missedDeadlines': self.missed,
+            'errors': self.errors,
+            'lastDuration': self.last_duration,
+            'maxDuration': self.max_duration,
+            'lastLateness': self.last_lateness,
+            'maxLateness': self.max_lateness
+        }
+
+
+class AcquisitionScheduler:
+    """ Triggers the acquisitions of all devices at absolute wall-clock instants.
+
+        The deadlines of all jobs are kept in a single heap. The next deadline
+        of a job is derived from its previous deadline rather than from the
+        end of the acquisition, so that the sampling does not drift.
+
+        An acquisition which is still running when its next deadline is due
+        is counted as an overrun and the deadline is skipped. Deadlines which
+        pass while the scheduler is blocked are counted as missed. """
+
+    def __init__(self, workers: int = ACQUISITION_WORKERS):
+        self.workers = workers
+        self.executor = None
+        self.loop = None
+        self.task = None
+
+        self.heap: list[tuple[float, int, Job]] = []
+        self.jobs: dict[str, Job] = {}
+        self.acquisitions: set[asyncio.Task] = set()
+        self.counter = itertools.count()
+        self.changed = asyncio.Event()
+
+    def schedule(self, key: str, period: float,
+                 acquire: Callable[[], dict],
+                 publish: Callable[[dict, dict], Awaitable]):
+        """ Adds or replaces the job of a device. May be called from any thread. """
+
+        if period <= 0:
+            raise kopf.PermanentError(f'Invalid acquisition period: {period}')
+
+        job = Job(key, period, acquire, publish)
+        self.loop.call_soon_threadsafe(self.add, job)
+
+    def unschedule(self, key: str):
+        """ Removes the job of a device. May be called from any thread. """
+
+        self.loop.call_soon_threadsafe(self.remove, key)
+
+    def add(self, job: Job):
+        # Statistics are kept when a job is changed
+        old = self.jobs.get(job.key)
+        if old is not None:
+            for attr in ['samples', 'overruns', 'missed', 'errors', 'max_duration', 'max_lateness']:
+                setattr(job, attr, getattr(old, attr))
+
+        self.remove(job.key)
+
+        self.jobs[job.key] = job
+        heapq.heappush(self.heap, (next_deadline(job.period, time.time()), next(self.counter), job))
+        self.changed.set()
+
+        logger.info('Scheduled acquisition of %s every %g s', job.key, job.period)
+
+    def remove(self, key: str):
+        job = self.jobs.pop(key, None)
+        if job is not None:
+            # Removed lazily when its deadline is popped from the heap
+            job.cancelled = True
+
+    def sample(self, job: Job, deadline: float) -> tuple[float, float, dict]:
+        """ Waits for the deadline and acquires a sample. Runs in a worker thread. """
+
+        delay = deadline - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+        start = time.time()
+        values = job.acquire()
+        end = time.time()
+
+        return start, end, values
+
+    async def acquire(self, job: Job, deadline: float):
+        job.busy = True
+
+        try:
+            start, end, values = await self.loop.run_in_executor(self.executor, self.sample, job, deadline)
+
+            job.samples += 1
+            job.last_duration = end - start
+            job.max_duration = max(job.max_duration, job.last_duration)
+            job.last_lateness = start - deadline
+            job.max_lateness = max(job.max_lateness, job.last_lateness)
+
+            if job.last_duration > job.period:
+                logger.warning('Acquisition of %s took %.3f s which exceeds its period of %g s', job.key, job.last_duration, job.period)
+
+            sample = {
+                'timestamp': timestamp(start),
+                'scheduled': timestamp(deadline),
+                'duration': job.last_duration,
+                **values
+            }
+        except Exception as e:
+            job.errors += 1
+            logger.error('Failed to acquire measurements of %s: %s', job.key, e)
+            return
+        finally:
+            job.busy = False
+
+        if job.cancelled:
+            return
+
+        try:
+            await job.publish(sample, job.statistics())
+        except Exception as e:
+            logger.error('Failed to publish measurements of %s: %s', job.key, e)
+
+    def dispatch(self, deadline: float, job: Job):
+        now = time.time()
+
+        # Skip all deadlines which have already passed
+        if now > deadline + job.period:
+            skipped = math.floor((now - deadline) / job.period)
+            job.missed += skipped
+            deadline += skipped * job.period
+
+            logger.warning('Missed %d deadlines of %s', skipped, job.key)
+
+        if job.busy:
+            job.overruns += 1
+            job.missed += 1
+        else:
+            task = asyncio.create_task(self.acquire(job, deadline))
+            self.acquisitions.add(task)
+            task.add_done_callback(self.acquisitions.discard)
+
+        heapq.heappush(self.heap, (deadline + job.period, next(self.counter), job))
+
+    async def run(self):
+        while True:
+            self.changed.clear()
+
+            while self.heap and self.heap[0][2].cancelled:
+                heapq.heappop(self.heap)
+
+            if self.heap:
+                timeout = self.heap[0][0] - WAKEUP_ADVANCE - time.time()
+            else:
+                timeout = None
+
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+                continue
+
+            deadline, _, job = heapq.heappop(self.heap)
+            self.dispatch(deadline, job)
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix='acquisition')
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        tasks = list(self.acquisitions)
+        if self.task is not None:
+            tasks.append(self.task)
+
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+scheduler = AcquisitionScheduler()
+
+
+@kopf.on.startup()
+async def start_acquisition(**_):
+    scheduler.start()
+
+
+@kopf.on.cleanup()
+async def stop_acquisition(**_):
+    await scheduler.stop()
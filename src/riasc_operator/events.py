@@ -0,0 +1,234 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+import kopf
+
+# Identical messages for the same object are only posted once within this window. 0 disables deduplication.
+EVENTS_DEDUP_WINDOW = float(os.environ.get('EVENTS_DEDUP_WINDOW', '300'))  # [s]
+
+# Sustained rate and burst size of the events posted per object. A rate of 0 disables rate limiting.
+EVENTS_RATE = float(os.environ.get('EVENTS_RATE', '0.1'))  # [1/s]
+EVENTS_BURST = int(os.environ.get('EVENTS_BURST', '10'))
+
+# Post the messages of the handler loggers as events. kopf does not post them by default.
+EVENTS_POST_LOGGERS = os.environ.get('EVENTS_POST_LOGGERS', 'false') in ['true', '1', 'on']
+
+# Post a summary of the progress messages of a handler instead of each single message
+EVENTS_SUMMARIZE = os.environ.get('EVENTS_SUMMARIZE', 'true') in ['true', '1', 'on']
+
+# Number of items listed in a summary before it is truncated
+SUMMARY_ITEMS = 3
+
+# Number of tracked messages or objects after which expired entries are pruned
+PRUNE_THRESHOLD = 10000
+
+# Passed as extra to mark messages which report the progress on a single item,
+# e.g. logger.info('Patched node %s', node, extra=events.PROGRESS)
+PROGRESS = {'progress': True}
+
+logger = logging.getLogger(__name__)
+
+current_summary: contextvars.ContextVar['Summary | None'] = contextvars.ContextVar('current_summary', default=None)
+
+
+class Summary:
+    """ Collects the progress messages of a single handler run """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.items: dict[str, tuple[list[int], list]] = {}
+
+    def add(self, record: logging.LogRecord):
+        with self.lock:
+            count, args = self.items.setdefault(str(record.msg), ([0], []))
+
+            count[0] += 1
+            if len(args) < SUMMARY_ITEMS:
+                args.append(record.args)
+
+    def post(self, logger: kopf.Logger):
+        for template, (count, args) in self.items.items():
+            more = f' and {count[0] - len(args)} more' if count[0] > len(args) else ''
+            messages = [template % a for a in args]
+
+            # Messages whose last word names a single item are merged into a single message listing the items,
+            # e.g. 'RoleBinding is removed: admin-u1, admin-u2 and 3 more'
+            prefix = item_prefix(template)
+            if prefix is not None and all(isinstance(a, tuple) and len(a) == 1 for a in args):
+                logger.info('%s%s%s', prefix, ', '.join(m[len(prefix):] for m in messages), more)
+            else:
+                logger.info('%s%s', ', '.join(messages), more)
+
+
+def item_prefix(template: str) -> str | None:
+    """ Returns the text before the last word of a template if it contains the only placeholder """
+
+    if template.count('%') != 1 or '%s' not in template:
+        return None
+
+    prefix, _, word = template.rpartition(' ')
+    if '%s' not in word:
+        return None
+
+    return prefix + ' '
+
+
+def summarize(fn):
+    """ Aggregates the progress messages of a handler into summary events """
+
+    if not EVENTS_SUMMARIZE:
+        return fn
+
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, logger: kopf.Logger, **kwargs):
+            summary = Summary()
+            token = current_summary.set(summary)
+            try:
+                return await fn(*args, logger=logger, **kwargs)
+            finally:
+                current_summary.reset(token)
+                summary.post(logger)
+
+        return async_wrapper
+    else:
+        @functools.wraps(fn)
+        def wrapper(*args, logger: kopf.Logger, **kwargs):
+            summary = Summary()
+            token = current_summary.set(summary)
+            try:
+                return fn(*args, logger=logger, **kwargs)
+            finally:
+                current_summary.reset(token)
+                summary.post(logger)
+
+        return wrapper
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float, burst: int, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+    def full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class EventPolicy(logging.Filter):
+    """ Decides which messages of the object loggers are posted as Kubernetes events.
+
+        Suppressed messages are only excluded from posting by setting the
+        k8s_skip attribute which is honored by kopf. They still reach the
+        process log. """
+
+    def __init__(self, dedup_window: float = EVENTS_DEDUP_WINDOW, rate: float = EVENTS_RATE, burst: int = EVENTS_BURST):
+        super().__init__()
+
+        self.dedup_window = dedup_window
+        self.rate = rate
+        self.burst = burst
+
+        self.lock = threading.Lock()
+        self.posted: dict[tuple, float] = {}
+        self.buckets: dict[str, TokenBucket] = {}
+
+        self.suppressed = {
+            'progress': 0,
+            'duplicate': 0,
+            'rate': 0
+        }
+
+    def prune(self, now: float):
+        if len(self.posted) > PRUNE_THRESHOLD:
+            self.posted = {key: t for key, t in self.posted.items() if now - t < self.dedup_window}
+
+        if len(self.buckets) > PRUNE_THRESHOLD:
+            self.buckets = {key: bucket for key, bucket in self.buckets.items() if not bucket.full(now)}
+
+    def decide(self, record: logging.LogRecord) -> str | None:
+        """ Returns the reason for suppressing the event of a record, or None if it should be posted """
+
+        if getattr(record, 'progress', False):
+            summary = current_summary.get()
+            if summary is not None:
+                summary.add(record)
+                return 'progress'
+
+        uid = record.k8s_ref.get('uid')
+        now = time.monotonic()
+
+        with self.lock:
+            self.prune(now)
+
+            if self.dedup_window > 0:
+                key = (uid, record.levelno, record.getMessage())
+                last = self.posted.get(key)
+                if last is not None and now - last < self.dedup_window:
+                    return 'duplicate'
+
+            if self.rate > 0:
+                bucket = self.buckets.get(uid)
+                if bucket is None:
+                    bucket = self.buckets[uid] = TokenBucket(self.rate, self.burst, now)
+
+                if not bucket.take(now):
+                    return 'rate'
+
+            if self.dedup_window > 0:
+                self.posted[key] = now
+
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Only records of object loggers which would be posted are considered
+        if not hasattr(record, 'k8s_ref') or getattr(record, 'k8s_skip', False):
+            return True
+
+        reason = self.decide(record)
+        if reason is not None:
+            record.k8s_skip = True
+            self.suppressed[reason] += 1
+
+        return True
+
+
+policy = EventPolicy()
+
+
+@kopf.on.startup()
+def install_event_policy(settings: kopf.OperatorSettings, **_):
+    if EVENTS_POST_LOGGERS:
+        settings.posting.loggers = True
+
+    # Nothing to decide if no messages are posted
+    if not settings.posting.enabled or not settings.posting.loggers:
+        return
+
+    logging.getLogger('kopf.objects').addFilter(policy)
+
+    logger.info('Event policy: dedup_window=%gs, rate=%g/s, burst=%d, summarize=%s',
+                policy.dedup_window, policy.rate, policy.burst, EVENTS_SUMMARIZE)
+
+
+@kopf.on.cleanup()
+def remove_event_policy(**_):
+    logging.getLogger('kopf.objects').removeFilter(policy)
+
+    logger.info('Suppressed events: %s', policy.suppressed)
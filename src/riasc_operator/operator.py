@@ -1,6 +1,10 @@
 import kopf
 
+import riasc_operator.api  # noqa: F401
+import riasc_operator.events  # noqa: F401
+import riasc_operator.profiling  # noqa: F401
 import riasc_operator.project  # noqa: F401
+import riasc_operator.scheduler_config  # noqa: F401
 import riasc_operator.time_sync  # noqa: F401
 
 
@@ -0,0 +1,217 @@
+import asyncio
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import types
+import kopf
+
+from aiohttp import web
+
+# Address of the HTTP endpoint (e.g. 127.0.0.1:8081). Disabled if unset.
+PROFILING_ADDR = os.environ.get('PROFILING_ADDR')
+PROFILING_DIR = os.environ.get('PROFILING_DIR', '/tmp')
+PROFILING_INTERVAL = float(os.environ.get('PROFILING_INTERVAL', '0.005'))  # [s]
+
+DEFAULT_DURATION = 10.0  # [s]
+MAX_DURATION = 120.0  # [s]
+
+# Modules containing the kopf handlers which are profiled
+HANDLER_MODULES = [
+    'riasc_operator.project',
+    'riasc_operator.time_sync',
+    'riasc_operator.scheduler_config',
+    'riasc_operator.devices.'
+]
+
+logger = logging.getLogger(__name__)
+
+
+def handler_codes() -> dict[types.CodeType, str]:
+    """ Returns the code objects of all functions in the handler modules """
+
+    codes = {}
+    for name, module in list(sys.modules.items()):
+        if not any(name == prefix or name.startswith(prefix) for prefix in HANDLER_MODULES):
+            continue
+
+        for obj in vars(module).values():
+            func = getattr(obj, '__wrapped__', obj)
+            if isinstance(func, types.FunctionType) and func.__module__ == name:
+                codes[func.__code__] = f'{name}.{func.__name__}'
+
+    return codes
+
+
+def frame_label(code: types.CodeType) -> str:
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def await_chain(coro) -> list[types.CodeType]:
+    """ Returns the code objects of a suspended coroutine and of everything it awaits, outermost first """
+
+    stack = []
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None) or getattr(coro, 'ag_frame', None)
+        if frame is None:
+            break
+
+        stack.append(frame.f_code)
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None) or getattr(coro, 'ag_await', None)
+
+    return stack
+
+
+class Profiler:
+    """ A sampling profiler for the operator handlers.
+
+        A background thread periodically inspects the stacks of all threads
+        and the await chains of all suspended tasks of the event loop, as
+        awaiting coroutines have no frame on any thread. Samples are only
+        recorded if they are executing or awaiting a function of one of the
+        handler modules, and tagged with the outermost such function.
+        Nothing is installed while no profile is running. """
+
+    def __init__(self, interval: float = PROFILING_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.loop = None
+
+    def sample(self, codes: dict, counts: collections.Counter):
+        own = threading.get_ident()
+
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+
+            stack = []
+            handler = None
+            while frame is not None:
+                stack.append(frame.f_code)
+                if frame.f_code in codes:
+                    handler = len(stack)
+
+                frame = frame.f_back
+
+            if handler is not None:
+                counts[tuple(reversed(stack[:handler]))] += 1
+
+        if self.loop is None:
+            return
+
+        for task in asyncio.all_tasks(self.loop):
+            coro = task.get_coro()
+
+            # The running task is already sampled by its thread
+            if getattr(coro, 'cr_running', False):
+                continue
+
+            stack = await_chain(coro)
+            handler = next((n for n, code in enumerate(stack) if code in codes), None)
+
+            if handler is not None:
+                counts[tuple(stack[handler:])] += 1
+
+    def run(self, duration: float) -> str:
+        """ Profiles the handlers for the given duration.
+
+            Returns the samples in the collapsed stack format
+            as consumed by flamegraph.pl or speedscope. """
+
+        if not self.lock.acquire(blocking=False):
+            raise RuntimeError('A profile is already running')
+
+        try:
+            codes = handler_codes()
+            counts = collections.Counter()
+
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                self.sample(codes, counts)
+                time.sleep(self.interval)
+        finally:
+            self.lock.release()
+
+        lines = []
+        for stack, count in counts.most_common():
+            frames = [codes[stack[0]]] + [frame_label(code) for code in stack]
+            lines.append(';'.join(frames) + f' {count}')
+
+        return '\n'.join(lines) + '\n'
+
+
+profiler = Profiler()
+
+
+async def handle_profile(request: web.Request) -> web.Response:
+    try:
+        duration = float(request.query.get('seconds', DEFAULT_DURATION))
+    except ValueError:
+        raise web.HTTPBadRequest(text='Invalid duration')
+
+    if duration <= 0 or duration > MAX_DURATION:
+        raise web.HTTPBadRequest(text=f'Duration must be in (0, {MAX_DURATION}] seconds')
+
+    loop = asyncio.get_running_loop()
+
+    try:
+        folded = await loop.run_in_executor(None, profiler.run, duration)
+    except RuntimeError as e:
+        raise web.HTTPConflict(text=str(e))
+
+    return web.Response(text=folded, content_type='text/plain')
+
+
+def profile_to_file(duration: float = DEFAULT_DURATION):
+    try:
+        folded = profiler.run(duration)
+    except RuntimeError as e:
+        logger.warning('Ignoring profiling request: %s', e)
+        return
+
+    fn = os.path.join(PROFILING_DIR, time.strftime('riasc-operator-%Y%m%d-%H%M%S.folded'))
+    with open(fn, 'w') as f:
+        f.write(folded)
+
+    logger.info('Wrote handler profile to %s', fn)
+
+
+@kopf.on.startup()
+async def start_profiling(memo: kopf.Memo, **_):
+    loop = asyncio.get_running_loop()
+
+    profiler.loop = loop
+
+    # Sending SIGUSR2 profiles the handlers and writes the result to PROFILING_DIR
+    loop.add_signal_handler(signal.SIGUSR2, lambda: threading.Thread(target=profile_to_file, daemon=True).start())
+
+    if not PROFILING_ADDR:
+        return
+
+    host, _, port = PROFILING_ADDR.rpartition(':')
+
+    app = web.Application()
+    app.router.add_get('/debug/profile', handle_profile)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+
+    site = web.TCPSite(runner, host or '127.0.0.1', int(port))
+    await site.start()
+
+    memo.profiling_runner = runner
+
+    logger.info('Profiling endpoint is listening on %s', PROFILING_ADDR)
+
+
+@kopf.on.cleanup()
+async def stop_profiling(memo: kopf.Memo, **_):
+    loop = asyncio.get_running_loop()
+    loop.remove_signal_handler(signal.SIGUSR2)
+
+    runner = memo.get('profiling_runner')
+    if runner is not None:
+        await runner.cleanup()
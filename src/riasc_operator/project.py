@@ -1,79 +1,96 @@
+import asyncio
 import os
 import kopf
-from kubernetes import client
-
-from riasc_operator.utils.labels import label_conflicts
-
-
-def label_nodes(logger: kopf.Logger, nodes: list[str], key: str, value: str | None):
-    api = client.CoreV1Api()
-
-    for node in nodes:
-        try:
-            api.patch_node(node, body={
-                'metadata': {
-                    'labels': {
-                        key: value
-                    }}
-            })
-        except Exception as e:
-            raise kopf.PermanentError('Failed to label node with project label: ' + str(e))
-        finally:
-            logger.info('Patched annotations of node %s', node)
-
-
-def add_users(logger: kopf.Logger, namespace: str, users: list[str]):
-    rbac_api = client.RbacAuthorizationV1Api()
-
-    for user in users:
-        rb = client.V1RoleBinding(
-            metadata=client.V1ObjectMeta(
-                name=f'admin-{user}',
-                namespace=namespace
-            ),
-            role_ref=client.V1RoleRef(
+from kubernetes_asyncio import client
+
+from riasc_operator import events
+from riasc_operator.api import handler_error
+from riasc_operator.utils.labels import label_conflicts, project_node_selector
+
+# Pods are mutated by a separate riasc-admission deployment
+ADMISSION_EXTERNAL = os.environ.get('ADMISSION_EXTERNAL') in ['true', '1', 'on']
+
+
+async def label_node(logger: kopf.Logger, api: client.CoreV1Api, node: str, key: str, value: str | None):
+    try:
+        await api.patch_node(node, body={
+            'metadata': {
+                'labels': {
+                    key: value
+                }}
+        })
+    except Exception as e:
+        raise handler_error('Failed to label node with project label', e)
+    finally:
+        logger.info('Patched annotations of node %s', node, extra=events.PROGRESS)
+
+
+async def label_nodes(logger: kopf.Logger, api: client.ApiClient, nodes: list[str], key: str, value: str | None):
+    core_api = client.CoreV1Api(api)
+
+    await asyncio.gather(*[label_node(logger, core_api, node, key, value) for node in nodes])
+
+
+async def add_user(logger: kopf.Logger, rbac_api: client.RbacAuthorizationV1Api, namespace: str, user: str):
+    rb = client.V1RoleBinding(
+        metadata=client.V1ObjectMeta(
+            name=f'admin-{user}',
+            namespace=namespace
+        ),
+        role_ref=client.V1RoleRef(
+            api_group='rbac.authorization.k8s.io',
+            kind='ClusterRole',
+            name='admin'
+        ),
+        subjects=[
+            client.RbacV1Subject(
                 api_group='rbac.authorization.k8s.io',
-                kind='ClusterRole',
-                name='admin'
-            ),
-            subjects=[
-                client.V1Subject(
-                    api_group='rbac.authorization.k8s.io',
-                    kind='User',
-                    name=user
-                )
-            ]
-        )
+                kind='User',
+                name=user
+            )
+        ]
+    )
+
+    kopf.adopt(rb)
+
+    rb = await rbac_api.create_namespaced_role_binding(namespace, rb)
+    logger.info('RoleBinding is added: %s', rb.metadata.name, extra=events.PROGRESS)
+
+
+async def add_users(logger: kopf.Logger, api: client.ApiClient, namespace: str, users: list[str]):
+    rbac_api = client.RbacAuthorizationV1Api(api)
 
-        kopf.adopt(rb)
+    await asyncio.gather(*[add_user(logger, rbac_api, namespace, user) for user in users])
 
-        rb = rbac_api.create_namespaced_role_binding(namespace, rb)
-        logger.info('RoleBinding is added: %s', rb.metadata.name)
 
+async def remove_user(logger: kopf.Logger, rbac_api: client.RbacAuthorizationV1Api, namespace: str, user: str):
+    await rbac_api.delete_namespaced_role_binding(f'admin-{user}', namespace)
+    logger.info('RoleBinding is removed: admin-%s', user, extra=events.PROGRESS)
 
-def remove_users(logger: kopf.Logger, namespace: str, users: list[str]):
-    rbac_api = client.RbacAuthorizationV1Api()
 
-    for user in users:
-        rbac_api.delete_namespaced_role_binding(f'admin-{user}', namespace)
-        logger.info(f'RoleBinding is removed: admin-{user}')
+async def remove_users(logger: kopf.Logger, api: client.ApiClient, namespace: str, users: list[str]):
+    rbac_api = client.RbacAuthorizationV1Api(api)
+
+    await asyncio.gather(*[remove_user(logger, rbac_api, namespace, user) for user in users])
 
 
 @kopf.on.startup()
 def config(settings: kopf.OperatorSettings, **_):
     env = os.environ.get('ENV', 'development')
-    if env == 'production':
+    if ADMISSION_EXTERNAL:
+        return
+    elif env == 'production':
         settings.admission.server = kopf.WebhookServer(
             addr=os.environ.get('ADMISSION_ADDR'),
             certfile=os.environ.get('ADMISSION_CERTFILE'),
-            pkeyfile=os.environ.get('ADMISSION_PKEYFILE')
+            pkeyfile=os.environ.get('ADMISSION_PKEYFILE'),
+            insecure=os.environ.get('ADMISSION_INSECURE') in ['true', '1', 'on']
         )
     elif env == 'development':
         settings.admission.server = kopf.WebhookMinikubeServer()
         settings.admission.managed = 'project.riasc.eu'
 
 
-@kopf.index('riasc.eu', 'v1', 'projects')
 def projects_index(name: str, spec: kopf.Spec, **_):
     return {name: spec}
 
@@ -81,42 +98,47 @@ def projects_index(name: str, spec: kopf.Spec, **_):
 @kopf.on.resume('riasc.eu', 'v1', 'projects')
 @kopf.on.create('riasc.eu', 'v1', 'projects')
 @kopf.on.update('riasc.eu', 'v1', 'projects')
-def resume_project(logger: kopf.Logger, name: str, spec: kopf.Spec, **_):
+@events.summarize
+async def resume_project(logger: kopf.Logger, memo: kopf.Memo, name: str, spec: kopf.Spec, **_):
     nodes = spec.get('nodes', [])
-    label_nodes(logger, nodes, f'project.riasc.eu/{name}', '')
+    await label_nodes(logger, memo.api, nodes, f'project.riasc.eu/{name}', '')
 
 
 @kopf.on.delete('riasc.eu', 'v1', 'projects')
-def delete_project(logger: kopf.Logger, name: str, spec: kopf.Spec, **_):
+@events.summarize
+async def delete_project(logger: kopf.Logger, memo: kopf.Memo, name: str, spec: kopf.Spec, **_):
     nodes = spec.get('nodes', [])
-    label_nodes(logger, nodes, f'project.riasc.eu/{name}', None)
+    await label_nodes(logger, memo.api, nodes, f'project.riasc.eu/{name}', None)
 
 
 @kopf.on.update('riasc.eu', 'v1', 'projects', field='spec.nodes')
-def update_project_nodes(logger: kopf.Logger, name: str, old: list[str], new: list[str], **_):
+@events.summarize
+async def update_project_nodes(logger: kopf.Logger, memo: kopf.Memo, name: str, old: list[str], new: list[str], **_):
     added = set(new or []) - set(old or [])
     removed = set(old or []) - set(new or [])
 
     logger.info('Handling changed nodes: added=%s, removed=%s', added, removed)
 
-    label_nodes(logger, added, f'project.riasc.eu/{name}', '')
-    label_nodes(logger, removed, f'project.riasc.eu/{name}', None)
+    await label_nodes(logger, memo.api, added, f'project.riasc.eu/{name}', '')
+    await label_nodes(logger, memo.api, removed, f'project.riasc.eu/{name}', None)
 
 
 @kopf.on.update('riasc.eu', 'v1', 'projects', field='spec.users')
-def update_project_users(logger: kopf.Logger, name: str, old: list[str], new: list[str], **_):
+@events.summarize
+async def update_project_users(logger: kopf.Logger, memo: kopf.Memo, name: str, old: list[str], new: list[str], **_):
     added = set(new or []) - set(old or [])
     removed = set(old or []) - set(new or [])
 
     logger.info('Handling changed users: added=%s, removed=%s', added, removed)
 
-    add_users(logger, name, added)
-    remove_users(logger, name, removed)
+    await add_users(logger, memo.api, name, added)
+    await remove_users(logger, memo.api, name, removed)
 
 
 @kopf.on.create('riasc.eu', 'v1', 'projects')
-def create_project(logger: kopf.Logger, name: str, spec: kopf.Spec, **_):
-    api = client.CoreV1Api()
+@events.summarize
+async def create_project(logger: kopf.Logger, memo: kopf.Memo, name: str, spec: kopf.Spec, **_):
+    api = client.CoreV1Api(memo.api)
 
     ns = client.V1Namespace(
         metadata=client.V1ObjectMeta(
@@ -129,17 +151,13 @@ def create_project(logger: kopf.Logger, name: str, spec: kopf.Spec, **_):
 
     kopf.adopt(ns)
 
-    ns = api.create_namespace(ns)
+    ns = await api.create_namespace(ns)
     logger.info('Namespace is created: %s', ns.metadata.name)
 
     users = spec.get('users', [])
-    add_users(logger, name, users)
+    await add_users(logger, memo.api, name, users)
 
 
-@kopf.on.mutate('v1', 'pod',
-                persistent=True,
-                side_effects=False,
-                ignore_failures=True)
 def validate_node_selector(projects_index: kopf.Index, spec: kopf.Spec, namespace: str, name: str, patch: dict, logger: kopf.Logger, **_):
     project_name = namespace
     projects = projects_index.get(project_name)
@@ -149,11 +167,8 @@ def validate_node_selector(projects_index: kopf.Index, spec: kopf.Spec, namespac
 
     project = projects[0]
 
-    podNodeSelector = spec.get('nodeSelector', {})
-    projectNodeSelector = project.get('nodeSelector', {})
-
-    if project.get('nodes', []):
-        projectNodeSelector[f'project.riasc.eu/{project_name}'] = ''
+    podNodeSelector = dict(spec.get('nodeSelector', {}))
+    projectNodeSelector = project_node_selector(project_name, project)
 
     if label_conflicts(projectNodeSelector, podNodeSelector):
         raise kopf.AdmissionError(f'Conflicting nodeSelector for project {project_name}')
@@ -163,3 +178,12 @@ def validate_node_selector(projects_index: kopf.Index, spec: kopf.Spec, namespac
     patch['spec'] = {
         'nodeSelector': podNodeSelector
     }
+
+
+# kopf refuses to start without an admission server if any admission handler is registered
+if not ADMISSION_EXTERNAL:
+    kopf.index('riasc.eu', 'v1', 'projects')(projects_index)
+    kopf.on.mutate('v1', 'pod',
+                   persistent=True,
+                   side_effects=False,
+                   ignore_failures=True)(validate_node_selector)
@@ -0,0 +1,412 @@
+import copy
+import json
+import re
+import kopf
+
+from kubernetes_asyncio import client
+from kubernetes_asyncio.client.exceptions import ApiException
+
+TEMPLATE_VARIABLE = re.compile(r'\{%\s*([a-z_]+)(?:\[(\d+)\])?\s*%\}')
+
+NODE_LABEL = 'schedulerconfig.riasc.eu/node'
+
+
+def address_node(name: str, address: dict) -> str:
+    """ Returns the node which runs the tests scheduled by an address """
+    return address.get('_meta', {}).get('node', name)
+
+
+def render(value, addresses: dict, members: tuple[str, ...], scheduled_by: int):
+    """ Substitutes pSConfig template variables like {% address[0] %} """
+
+    if isinstance(value, dict):
+        return {k: render(v, addresses, members, scheduled_by) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [render(v, addresses, members, scheduled_by) for v in value]
+    elif not isinstance(value, str):
+        return value
+
+    def substitute(m: re.Match) -> str:
+        var, index = m.group(1), m.group(2)
+
+        if var in ['address', 'pscheduler_address', 'lead_bind_address']:
+            address = addresses[members[int(index or 0)]]
+            if var == 'pscheduler_address':
+                return address.get('pscheduler-address', address['address'])
+            elif var == 'lead_bind_address':
+                return address.get('lead-bind-address', address['address'])
+            return address['address']
+        elif var == 'scheduled_by_address':
+            return addresses[members[scheduled_by if scheduled_by < len(members) else 0]]['address']
+        elif var == 'flip':
+            # The test is flipped if it is not scheduled by the first address
+            return 'true' if 0 < scheduled_by < len(members) else 'false'
+
+        raise kopf.PermanentError(f'Unsupported template variable: {var}')
+
+    return TEMPLATE_VARIABLE.sub(substitute, value)
+
+
+class GroupExpansion:
+    """ Expands a pSConfig group into the tuples of addresses to be tested.
+
+        The expansion is kept up-to-date incrementally. Adding or removing an
+        address only computes the tuples involving this address, using an
+        index of the tuples by their member addresses. """
+
+    def __init__(self, group: dict):
+        self.type = group.get('type')
+        self.unidirectional = group.get('unidirectional', False)
+
+        self.members: dict[str, list[str]] = {}
+        self.tuples: set[tuple[str, ...]] = set()
+        self.by_member: dict[str, set[tuple[str, ...]]] = {}
+
+        if self.type not in ['mesh', 'disjoint', 'list']:
+            raise kopf.PermanentError(f'Unsupported group type: {self.type}')
+
+        self.update(group)
+
+    @staticmethod
+    def group_members(group: dict) -> dict[str, list[str]]:
+        def names(addrs: list[dict]) -> list[str]:
+            return [addr['name'] for addr in addrs]
+
+        if group.get('type') == 'disjoint':
+            return {
+                'a': names(group.get('a-addresses', [])),
+                'b': names(group.get('b-addresses', []))
+            }
+        else:
+            return {
+                'a': names(group.get('addresses', []))
+            }
+
+    def compatible(self, group: dict) -> bool:
+        return self.type == group.get('type') and self.unidirectional == group.get('unidirectional', False)
+
+    def add(self, tup: tuple[str, ...], added: set):
+        if tup in self.tuples:
+            return
+
+        self.tuples.add(tup)
+        for member in tup:
+            self.by_member.setdefault(member, set()).add(tup)
+
+        added.add(tup)
+
+    def remove_member(self, member: str, removed: set):
+        for tup in self.by_member.pop(member, set()):
+            self.tuples.discard(tup)
+            for other in tup:
+                if other != member:
+                    self.by_member[other].discard(tup)
+
+            removed.add(tup)
+
+    def update(self, group: dict) -> tuple[set, set]:
+        """ Updates the expansion to a changed group.
+
+            Returns the sets of added and removed tuples. """
+
+        new = self.group_members(group)
+        old = self.members
+
+        added, removed = set(), set()
+
+        # Removing a member drops all its tuples. Members which are left
+        # on another side of a disjoint group are added again below.
+        gone = set()
+        for side, names in old.items():
+            for name in set(names) - set(new.get(side, [])):
+                self.remove_member(name, removed)
+                gone.add(name)
+
+        self.members = new
+
+        fresh = {
+            side: (set(names) - set(old.get(side, []))) | (gone & set(names))
+            for side, names in new.items()
+        }
+
+        if self.type == 'list':
+            for name in fresh['a']:
+                self.add((name,), added)
+
+        elif self.type == 'mesh':
+            current = set(new['a'])
+            for name in fresh['a']:
+                for other in current:
+                    if other != name:
+                        self.add((name, other), added)
+                        self.add((other, name), added)
+
+        elif self.type == 'disjoint':
+            for name in fresh['a']:
+                for other in new['b']:
+                    self.add((name, other), added)
+                    if not self.unidirectional:
+                        self.add((other, name), added)
+
+            for name in fresh['b']:
+                for other in new['a']:
+                    self.add((other, name), added)
+                    if not self.unidirectional:
+                        self.add((name, other), added)
+
+        # Tuples which have been removed and re-added are unchanged
+        unchanged = added & removed
+        return added - unchanged, removed - unchanged
+
+
+class Expansion:
+    """ Expands the tasks of a pSConfig template into per-node assignments """
+
+    def __init__(self):
+        self.spec = {}
+        self.groups: dict[str, GroupExpansion] = {}
+        self.assignments: dict[str, dict[str, dict]] = {}
+        self.published: set[str] = set()
+        self.dirty: set[str] = set()
+
+    def task_config(self, spec: dict, task: dict) -> dict:
+        """ Returns everything a task assignment depends on except group membership """
+
+        return {
+            'test': spec.get('tests', {}).get(task.get('test')),
+            'archives': [spec.get('archives', {}).get(name) for name in task.get('archives', [])],
+            'schedule': spec.get('schedules', {}).get(task.get('schedule')),
+            'tools': task.get('tools'),
+            'scheduled-by': task.get('scheduled-by', 0),
+            'disabled': task.get('disabled', False)
+        }
+
+    def locate(self, spec: dict, name: str, task: dict, tup: tuple[str, ...]) -> tuple[str, str]:
+        """ Returns the node and key of the assignment of a tuple """
+
+        addresses = spec.get('addresses', {})
+        scheduled_by = task.get('scheduled-by', 0)
+
+        for member in tup:
+            if member not in addresses:
+                raise kopf.PermanentError(f'Task {name} references unknown address: {member}')
+
+        member = tup[scheduled_by] if scheduled_by < len(tup) else tup[0]
+        node = address_node(member, addresses[member])
+
+        return node, f'{name}/{"/".join(tup)}'
+
+    def assignment(self, spec: dict, name: str, task: dict, tup: tuple[str, ...]) -> tuple[str, str, dict]:
+        addresses = spec.get('addresses', {})
+        config = self.task_config(spec, task)
+        scheduled_by = config['scheduled-by']
+
+        node, key = self.locate(spec, name, task, tup)
+
+        if config['test'] is None:
+            raise kopf.PermanentError(f'Task {name} references unknown test: {task.get("test")}')
+
+        assignment = {
+            'task': name,
+            'addresses': list(tup),
+            'test': render(config['test'], addresses, tup, scheduled_by),
+            'archives': render([a for a in config['archives'] if a is not None], addresses, tup, scheduled_by)
+        }
+
+        if config['schedule'] is not None:
+            assignment['schedule'] = config['schedule']
+
+        if config['tools'] is not None:
+            assignment['tools'] = config['tools']
+
+        return node, key, assignment
+
+    def apply(self, spec: dict, name: str, task: dict, added: set, removed: set, affected: set):
+        old_spec = self.spec
+
+        for tup in removed:
+            node, key = self.locate(old_spec, name, old_spec['tasks'][name], tup)
+            self.assignments.get(node, {}).pop(key, None)
+            affected.add(node)
+
+        if task.get('disabled', False):
+            return
+
+        for tup in added:
+            node, key, assignment = self.assignment(spec, name, task, tup)
+            self.assignments.setdefault(node, {})[key] = assignment
+            affected.add(node)
+
+    def update(self, spec: dict):
+        """ Updates the assignments to a new spec.
+
+            Only tuples of tasks whose group membership changed, or whose
+            addresses changed, are recomputed. The affected nodes are marked
+            as dirty until their assignments have been published. """
+
+        old = self.spec
+        old_tasks = old.get('tasks', {})
+        new_tasks = spec.get('tasks', {})
+        old_addresses = old.get('addresses', {})
+        new_addresses = spec.get('addresses', {})
+
+        changed_addresses = {
+            name for name in set(old_addresses) & set(new_addresses)
+            if old_addresses[name] != new_addresses[name]
+        }
+
+        affected = set()
+
+        for name in set(old_tasks) - set(new_tasks):
+            expansion = self.groups.pop(name)
+            self.apply(spec, name, {}, set(), expansion.tuples, affected)
+
+        for name, task in new_tasks.items():
+            group = spec.get('groups', {}).get(task.get('group'))
+            if group is None:
+                raise kopf.PermanentError(f'Task {name} references unknown group: {task.get("group")}')
+
+            expansion = self.groups.get(name)
+            old_task = old_tasks.get(name)
+
+            # Recompute the whole task if anything but the group membership changed
+            if expansion is None or old_task is None or \
+               old_task.get('group') != task.get('group') or \
+               not expansion.compatible(group) or \
+               self.task_config(old, old_task) != self.task_config(spec, task):
+
+                removed = expansion.tuples if expansion else set()
+                expansion = GroupExpansion(group)
+                self.groups[name] = expansion
+
+                self.apply(spec, name, task, set(expansion.tuples), set(removed), affected)
+                continue
+
+            added, removed = expansion.update(group)
+
+            # Re-render the tuples of changed addresses
+            for address in changed_addresses:
+                tuples = expansion.by_member.get(address, set()) - added
+                removed |= tuples
+                added |= tuples
+
+            self.apply(spec, name, task, added, removed, affected)
+
+        self.spec = spec
+        self.dirty |= affected
+
+
+async def publish(logger: kopf.Logger, api: client.ApiClient, name: str, namespace: str, expansion: Expansion):
+    """ Publishes the assignments of the dirty nodes as per-node ConfigMaps """
+
+    core_api = client.CoreV1Api(api)
+
+    nodes = len(expansion.dirty)
+
+    for node in sorted(expansion.dirty):
+        cm_name = f'psconfig-{name}-{node}'
+        assignments = expansion.assignments.get(node, {})
+
+        if not assignments:
+            try:
+                await core_api.delete_namespaced_config_map(cm_name, namespace)
+            except ApiException as e:
+                if e.status != 404:
+                    raise
+
+            expansion.assignments.pop(node, None)
+            expansion.published.discard(node)
+            expansion.dirty.discard(node)
+            continue
+
+        cm = client.V1ConfigMap(
+            metadata=client.V1ObjectMeta(
+                name=cm_name,
+                labels={
+                    NODE_LABEL: node,
+                    'app.kubernetes.io/name': 'psconfig',
+                    'app.kubernetes.io/instance': name,
+                    'app.kubernetes.io/managed-by': 'riasc-operator'
+                }
+            ),
+            data={
+                'assignments.json': json.dumps([assignments[key] for key in sorted(assignments)])
+            }
+        )
+
+        kopf.adopt(cm)
+
+        if node in expansion.published:
+            await core_api.patch_namespaced_config_map(cm_name, namespace, cm)
+        else:
+            try:
+                await core_api.create_namespaced_config_map(namespace, cm)
+            except ApiException as e:
+                if e.status != 409:
+                    raise
+
+                await core_api.patch_namespaced_config_map(cm_name, namespace, cm)
+
+            expansion.published.add(node)
+
+        expansion.dirty.discard(node)
+
+    logger.info('Published test assignments for %d nodes', nodes)
+
+
+async def adopt_published(api: client.ApiClient, name: str, namespace: str, expansion: Expansion):
+    """ Marks the nodes of existing ConfigMaps as published.
+
+        A new expansion does not know which ConfigMaps have been published
+        before, e.g. after a restart or a failed update. Those of nodes without
+        assignments are marked as dirty, so that they are deleted. """
+
+    core_api = client.CoreV1Api(api)
+
+    selector = f'app.kubernetes.io/name=psconfig,app.kubernetes.io/instance={name}'
+    cms = await core_api.list_namespaced_config_map(namespace, label_selector=selector)
+
+    for cm in cms.items:
+        node = (cm.metadata.labels or {}).get(NODE_LABEL)
+        if node is None:
+            continue
+
+        expansion.published.add(node)
+        if node not in expansion.assignments:
+            expansion.dirty.add(node)
+
+
+@kopf.on.resume('riasc.eu', 'v1', 'schedulerconfigs')
+@kopf.on.create('riasc.eu', 'v1', 'schedulerconfigs')
+async def create_scheduler_config(logger: kopf.Logger, name: str, namespace: str, spec: kopf.Spec, memo: kopf.Memo, **_):
+    memo.expansion = Expansion()
+
+    try:
+        memo.expansion.update(copy.deepcopy(dict(spec)))
+    except Exception:
+        # The expansion might be inconsistent now, so start from scratch next time
+        del memo.expansion
+        raise
+
+    await adopt_published(memo.api, name, namespace, memo.expansion)
+    await publish(logger, memo.api, name, namespace, memo.expansion)
+
+
+@kopf.on.update('riasc.eu', 'v1', 'schedulerconfigs')
+async def update_scheduler_config(logger: kopf.Logger, name: str, namespace: str, spec: kopf.Spec, memo: kopf.Memo, **_):
+    fresh = 'expansion' not in memo
+    if fresh:
+        memo.expansion = Expansion()
+
+    try:
+        memo.expansion.update(copy.deepcopy(dict(spec)))
+    except Exception:
+        # The expansion might be inconsistent now, so start from scratch next time
+        del memo.expansion
+        raise
+
+    if fresh:
+        await adopt_published(memo.api, name, namespace, memo.expansion)
+
+    # Nodes which failed to be published by a previous attempt are still dirty
+    await publish(logger, memo.api, name, namespace, memo.expansion)
@@ -2,7 +2,7 @@ import json
 import kopf
 import os
 
-from kubernetes import client
+from kubernetes_asyncio import client
 from jinja2 import Template
 from dotmap import DotMap
 
@@ -11,6 +11,7 @@ NAMESPACE = os.environ.get('POD_NAMESPACE', 'riasc-system')
 PTP4L_TEMPLATE = Template('''
 [global]
     slaveOnly {{ '1' if ptp.slaveOnly else '0' }}
+    domainNumber {{ ptp.domainNumber | default(0) }}
 
     network_transport {{ ptp.transport }}
 
@@ -19,6 +20,9 @@ PTP4L_TEMPLATE = Template('''
 
     time_stamping {{ ptp.timestamping }}
 
+    # Management interface queried by time-sync-status
+    uds_address /run/ptp4l
+
     [{{ ptp.interface }}]
     # empty
 
@@ -109,9 +113,9 @@ NTP_DEFAULT_SERVERS = [
 
 
 @kopf.on.create('riasc.eu', 'v1', 'timesyncconfigs')
-def create_time_sync(logger: kopf.Logger, name: str, spec: kopf.Spec, **_):
-    api = client.CoreV1Api()
-    apps_api = client.AppsV1Api()
+async def create_time_sync(logger: kopf.Logger, memo: kopf.Memo, name: str, spec: kopf.Spec, **_):
+    api = client.CoreV1Api(memo.api)
+    apps_api = client.AppsV1Api(memo.api)
 
     spec = DotMap(dict(spec))
 
@@ -277,6 +281,7 @@ def create_time_sync(logger: kopf.Logger, name: str, spec: kopf.Spec, **_):
                 ),
                 client.V1VolumeMount(
                     name='config',
+                    mount_path='/etc/ptp4l.conf',
                     read_only=True,
                     sub_path='ptp4l.conf'
                 )
@@ -294,7 +299,13 @@ def create_time_sync(logger: kopf.Logger, name: str, spec: kopf.Spec, **_):
             ),
             template=client.V1PodTemplateSpec(
                 metadata=client.V1ObjectMeta(
-                    labels=labels
+                    labels=labels,
+                    annotations={
+                        # Metrics of time-sync-status
+                        'prometheus.io/scrape': 'true',
+                        'prometheus.io/port': '8099',
+                        'prometheus.io/path': '/metrics'
+                    }
                 ),
                 spec=client.V1PodSpec(
                     node_selector=spec.nodeSelector,
@@ -333,8 +344,8 @@ def create_time_sync(logger: kopf.Logger, name: str, spec: kopf.Spec, **_):
     kopf.adopt(cm)
     kopf.adopt(ds)
 
-    cm = api.create_namespaced_config_map(NAMESPACE, cm)
+    cm = await api.create_namespaced_config_map(NAMESPACE, cm)
     logger.info('ConfigMap is created: %s', cm.metadata.name)
 
-    ds = apps_api.create_namespaced_daemon_set(NAMESPACE, ds)
+    ds = await apps_api.create_namespaced_daemon_set(NAMESPACE, ds)
     logger.info('DaemonSet is created: %s', cm.metadata.name)
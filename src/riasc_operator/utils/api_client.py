@@ -0,0 +1,21 @@
+import os
+
+from kubernetes_asyncio import client, config
+
+# Maximum number of concurrent connections to the Kubernetes API
+API_CONNECTION_POOL_SIZE = int(os.environ.get('API_CONNECTION_POOL_SIZE', '32'))
+
+
+async def new_api_client() -> client.ApiClient:
+    """ Creates a pooled Kubernetes API client from the kubeconfig or in-cluster config """
+
+    cfg = client.Configuration()
+
+    if os.environ.get('KUBECONFIG'):
+        await config.load_kube_config(client_configuration=cfg)
+    else:
+        config.load_incluster_config(client_configuration=cfg)
+
+    cfg.connection_pool_maxsize = API_CONNECTION_POOL_SIZE
+
+    return client.ApiClient(cfg)
@@ -8,3 +8,14 @@ def label_conflicts(a: dict[str, str], b: dict[str, str]) -> bool:
             return True
 
     return False
+
+
+def project_node_selector(project_name: str, project: dict) -> dict[str, str]:
+    """ Returns the nodeSelector which is enforced for all pods of a project """
+
+    selector = dict(project.get('nodeSelector', {}))
+
+    if project.get('nodes', []):
+        selector[f'project.riasc.eu/{project_name}'] = ''
+
+    return selector
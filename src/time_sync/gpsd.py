@@ -0,0 +1,178 @@
+import logging
+import time
+
+from gpsdclient import GPSDClient
+
+from time_sync import metrics
+
+# Report classes consumed by the status agent.
+# All other classes are dropped by the client before being decoded.
+REPORT_CLASSES = ['TPV', 'SKY']
+
+PUBLISH_INTERVAL = 1.0  # [s]
+LOG_INTERVAL = 60.0  # [s]
+RECONNECT_INTERVAL = 5.0  # [s]
+
+# Weight of a new sample in the rolling position statistics
+POSITION_ALPHA = 0.05
+
+FIX_MODES = {
+    0: 'unknown',
+    1: 'none',
+    2: '2d',
+    3: '3d'
+}
+
+
+class RollingStats:
+    """ Exponentially weighted mean and variance of a sample stream.
+
+        Uses constant memory and time per sample, regardless of the
+        update rate of the receiver. """
+
+    def __init__(self, alpha: float = POSITION_ALPHA):
+        self.alpha = alpha
+        self.count = 0
+        self.mean = None
+        self.var = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+
+        if self.mean is None:
+            self.mean = value
+            return
+
+        diff = value - self.mean
+        incr = self.alpha * diff
+
+        self.mean += incr
+        self.var = (1 - self.alpha) * (self.var + diff * incr)
+
+    def to_dict(self) -> dict:
+        return {
+            'mean': self.mean,
+            'stddev': self.var ** 0.5,
+            'samples': self.count
+        }
+
+
+class GpsdCollector:
+    """ Folds TPV and SKY reports from gpsd into compact summaries """
+
+    def __init__(self):
+        self.tpv = {}
+        self.sky = {}
+
+        self.latitude = RollingStats()
+        self.longitude = RollingStats()
+        self.altitude = RollingStats()
+
+        self.fixes = {mode: 0 for mode in FIX_MODES.values()}
+        self.reports = 0
+
+    def feed(self, report: dict):
+        self.reports += 1
+
+        cls = report.get('class')
+        if cls == 'TPV':
+            self.feed_tpv(report)
+        elif cls == 'SKY':
+            self.feed_sky(report)
+
+    def feed_tpv(self, tpv: dict):
+        mode = tpv.get('mode', 0)
+        self.fixes[FIX_MODES.get(mode, 'unknown')] += 1
+
+        self.tpv = {
+            key: tpv.get(key) for key in ['mode', 'status', 'time', 'lat', 'lon', 'alt', 'ept', 'epx', 'epy', 'epv']
+        }
+
+        if mode >= 2 and 'lat' in tpv and 'lon' in tpv:
+            self.latitude.add(tpv['lat'])
+            self.longitude.add(tpv['lon'])
+
+        if mode >= 3 and 'alt' in tpv:
+            self.altitude.add(tpv['alt'])
+
+    def feed_sky(self, sky: dict):
+        # Some gpsd versions send SKY reports without satellites
+        # which only carry the dilution of precision.
+        summary = {
+            key: sky.get(key) for key in ['hdop', 'vdop', 'pdop']
+        }
+
+        satellites = sky.get('satellites')
+        if satellites is not None:
+            used = [sat for sat in satellites if sat.get('used')]
+            snrs = [sat['ss'] for sat in used if sat.get('ss')]
+
+            summary.update({
+                'visible': len(satellites),
+                'used': len(used),
+                'snr_mean': sum(snrs) / len(snrs) if snrs else None,
+                'snr_max': max(snrs) if snrs else None
+            })
+        elif 'nSat' in sky:
+            summary.update({
+                'visible': sky.get('nSat'),
+                'used': sky.get('uSat')
+            })
+        else:
+            # Keep satellite counts of previous report
+            summary = {**self.sky, **summary}
+
+        self.sky = summary
+
+    def snapshot(self) -> dict:
+        return {
+            'tpv': self.tpv,
+            'sky': self.sky,
+            'position': {
+                'latitude': self.latitude.to_dict(),
+                'longitude': self.longitude.to_dict(),
+                'altitude': self.altitude.to_dict()
+            },
+            'fixes': dict(self.fixes),
+            'reports': self.reports
+        }
+
+
+def update_status_gpsd(status: dict):
+    collector = GpsdCollector()
+
+    last_publish = 0.0
+    last_log = 0.0
+
+    while True:
+        client = GPSDClient()
+
+        try:
+            for report in client.dict_stream(convert_datetime=True, filter=REPORT_CLASSES):
+                collector.feed(report)
+
+                now = time.monotonic()
+                if now - last_publish < PUBLISH_INTERVAL:
+                    continue
+
+                # Replace instead of update the dict so that readers never
+                # observe a partially updated snapshot
+                status['gpsd'] = collector.snapshot()
+                metrics.update_gpsd(status['gpsd'])
+                last_publish = now
+
+                if now - last_log >= LOG_INTERVAL:
+                    logging.info('Received %d reports from GPSd: fix=%s, satellites=%s/%s',
+                                 collector.reports,
+                                 FIX_MODES.get(collector.tpv.get('mode', 0), 'unknown'),
+                                 collector.sky.get('used'),
+                                 collector.sky.get('visible'))
+                    last_log = now
+        except Exception as e:
+            logging.error('Failed to receive updates from GPSd: %s. Retrying in %d sec', e, RECONNECT_INTERVAL)
+
+            metrics.update_gpsd(None)
+        finally:
+            client.close()
+
+        time.sleep(RECONNECT_INTERVAL)
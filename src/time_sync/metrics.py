@@ -0,0 +1,268 @@
+import math
+
+from datetime import datetime, timezone
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value) -> str:
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    elif math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+
+    return repr(value)
+
+
+def number(value) -> float | None:
+    """ Converts a value to a float, returning None if it is missing or invalid """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class MetricFamily:
+    """ A metric family whose exposition text is rendered when it is updated.
+
+        Scrapes only concatenate the cached texts of all families, so they
+        do not depend on the number of updates or on the sources of the
+        samples. """
+
+    def __init__(self, name: str, help: str, type: str = 'gauge'):
+        self.name = name
+        self.header = f'# HELP {name} {help}\n# TYPE {name} {type}\n'
+        self.text = ''
+
+    def sample(self, value, labels: dict | None = None) -> str:
+        if labels:
+            label_text = ','.join(f'{key}="{escape(val)}"' for key, val in labels.items())
+            return f'{self.name}{{{label_text}}} {format_value(value)}\n'
+
+        return f'{self.name} {format_value(value)}\n'
+
+    def update(self, samples: list[tuple[dict | None, float | None]]):
+        """ Replaces all samples of the family. Samples without a value are omitted. """
+
+        lines = [self.sample(value, labels) for labels, value in samples if value is not None]
+
+        # Replacing the text is atomic, so a concurrent scrape never sees a partial family
+        self.text = self.header + ''.join(lines) if lines else ''
+
+    def set(self, value: float | None, **labels):
+        self.update([(labels, value)])
+
+    def clear(self):
+        self.text = ''
+
+
+class Registry:
+
+    def __init__(self):
+        self.families: list[MetricFamily] = []
+
+    def family(self, name: str, help: str, type: str = 'gauge') -> MetricFamily:
+        family = MetricFamily(name, help, type)
+        self.families.append(family)
+
+        return family
+
+    def render(self) -> str:
+        return ''.join(family.text for family in self.families)
+
+
+registry = Registry()
+
+synced = registry.family('time_sync_synced', 'Whether chrony is synchronized to a source (1) or not (0)')
+
+chrony_up = registry.family('chrony_up', 'Whether the last query of chrony succeeded')
+chrony_tracking_info = registry.family('chrony_tracking_info', 'Reference of the system clock')
+chrony_tracking_stratum = registry.family('chrony_tracking_stratum', 'Stratum of the system clock')
+chrony_tracking_ref_time = registry.family('chrony_tracking_reference_timestamp_seconds', 'Time of the last measurement of the reference source')
+chrony_tracking_correction = registry.family('chrony_tracking_system_time_offset_seconds', 'Current offset of the system clock to NTP time')
+chrony_tracking_last_offset = registry.family('chrony_tracking_last_offset_seconds', 'Estimated offset of the last clock update')
+chrony_tracking_rms_offset = registry.family('chrony_tracking_rms_offset_seconds', 'Long-term average of the offset')
+chrony_tracking_frequency = registry.family('chrony_tracking_frequency_ppm', 'Frequency error of the system clock')
+chrony_tracking_residual_frequency = registry.family('chrony_tracking_residual_frequency_ppm', 'Residual frequency of the reference source')
+chrony_tracking_skew = registry.family('chrony_tracking_skew_ppm', 'Estimated error bound of the frequency')
+chrony_tracking_root_delay = registry.family('chrony_tracking_root_delay_seconds', 'Total network path delay to the stratum-1 source')
+chrony_tracking_root_dispersion = registry.family('chrony_tracking_root_dispersion_seconds', 'Total dispersion accumulated to the stratum-1 source')
+chrony_tracking_update_interval = registry.family('chrony_tracking_last_update_interval_seconds', 'Interval between the last two clock updates')
+
+chrony_source_state = registry.family('chrony_source_state_info', 'Selection state of a time source')
+chrony_source_stratum = registry.family('chrony_source_stratum', 'Stratum of a time source')
+chrony_source_poll = registry.family('chrony_source_poll_interval_seconds', 'Polling interval of a time source')
+chrony_source_reach = registry.family('chrony_source_reachability', 'Reachability register of a time source (8 bit)')
+chrony_source_last_rx = registry.family('chrony_source_last_rx_seconds', 'Time since the last sample was received from a time source')
+chrony_source_last_sample = registry.family('chrony_source_last_sample_offset_seconds', 'Adjusted offset of the last sample of a time source')
+
+gpsd_up = registry.family('gpsd_up', 'Whether reports are received from gpsd')
+gpsd_fix_mode = registry.family('gpsd_fix_mode', 'Current fix mode (0=unknown, 1=none, 2=2D, 3=3D)')
+gpsd_fix_status = registry.family('gpsd_fix_status', 'Current fix status as reported by gpsd (e.g. 2=DGPS)')
+gpsd_fixes = registry.family('gpsd_fixes_total', 'Number of position reports by fix mode', 'counter')
+gpsd_reports = registry.family('gpsd_reports_total', 'Number of reports received from gpsd', 'counter')
+gpsd_satellites_visible = registry.family('gpsd_satellites_visible', 'Number of visible satellites')
+gpsd_satellites_used = registry.family('gpsd_satellites_used', 'Number of satellites used for the fix')
+gpsd_snr = registry.family('gpsd_satellites_snr_dbhz', 'Signal strength of the used satellites')
+gpsd_dop = registry.family('gpsd_dilution_of_precision', 'Dilution of precision')
+gpsd_error = registry.family('gpsd_error_estimate', 'Estimated errors of the fix (time in seconds, position in meters)')
+gpsd_position = registry.family('gpsd_position', 'Current position (latitude and longitude in degrees, altitude in meters)')
+gpsd_position_mean = registry.family('gpsd_position_mean', 'Rolling mean of the position')
+gpsd_position_stddev = registry.family('gpsd_position_stddev', 'Rolling standard deviation of the position')
+
+ptp_up = registry.family('ptp_up', 'Whether the last query of ptp4l succeeded')
+ptp_master_offset = registry.family('ptp_master_offset_seconds', 'Offset of the clock to its master')
+ptp_path_delay = registry.family('ptp_path_delay_seconds', 'Mean path delay to the master')
+ptp_steps_removed = registry.family('ptp_steps_removed', 'Number of hops to the grandmaster')
+ptp_grandmaster_info = registry.family('ptp_grandmaster_info', 'Identity and clock class of the grandmaster')
+ptp_port_state = registry.family('ptp_port_state_info', 'State of a PTP port')
+
+
+def render() -> str:
+    return registry.render()
+
+
+def update_synced(value: bool | None):
+    synced.set(None if value is None else int(value))
+
+
+def update_chrony(status: dict | None):
+    if not status:
+        chrony_up.set(0)
+
+        for family in registry.families:
+            if family.name.startswith('chrony_') and family is not chrony_up:
+                family.clear()
+
+        return
+
+    chrony_up.set(1)
+
+    ref_time = status.get('ref_time')
+    if isinstance(ref_time, datetime):
+        ref_time = ref_time.replace(tzinfo=timezone.utc).timestamp()
+
+    chrony_tracking_info.set(1,
+                             ref_id=f'{status.get("ref_id", 0):08X}',
+                             ref_name=status.get('ref_name'),
+                             leap_status=status.get('leap_status'))
+    chrony_tracking_stratum.set(status.get('stratum'))
+    chrony_tracking_ref_time.set(ref_time)
+    chrony_tracking_correction.set(status.get('current_correction'))
+    chrony_tracking_last_offset.set(status.get('last_offset'))
+    chrony_tracking_rms_offset.set(status.get('rms_offset'))
+    chrony_tracking_frequency.set(status.get('freq_ppm'))
+    chrony_tracking_residual_frequency.set(status.get('resid_freq_ppm'))
+    chrony_tracking_skew.set(status.get('skew_ppm'))
+    chrony_tracking_root_delay.set(status.get('root_delay'))
+    chrony_tracking_root_dispersion.set(status.get('root_dispersion'))
+    chrony_tracking_update_interval.set(status.get('last_update_interval'))
+
+    sources = status.get('sources', {})
+
+    def per_source(func) -> list:
+        return [({'source': name}, func(source)) for name, source in sources.items()]
+
+    def reach(source: dict) -> int | None:
+        try:
+            return int(source.get('reach'), 8)
+        except (TypeError, ValueError):
+            return None
+
+    def poll(source: dict) -> float | None:
+        exponent = number(source.get('poll'))
+        return None if exponent is None else 2 ** exponent
+
+    chrony_source_state.update([
+        ({'source': name, 'mode': source.get('mode'), 'state': source.get('state')}, 1)
+        for name, source in sources.items()
+    ])
+    chrony_source_stratum.update(per_source(lambda s: number(s.get('stratum'))))
+    chrony_source_poll.update(per_source(poll))
+    chrony_source_reach.update(per_source(reach))
+    chrony_source_last_rx.update(per_source(lambda s: number(s.get('last_rx'))))
+    chrony_source_last_sample.update(per_source(lambda s: number(s.get('last_sample'))))
+
+
+def update_gpsd(status: dict | None):
+    if not status:
+        gpsd_up.set(0)
+
+        for family in registry.families:
+            if family.name.startswith('gpsd_') and family is not gpsd_up:
+                family.clear()
+
+        return
+
+    gpsd_up.set(1)
+
+    tpv = status.get('tpv', {})
+    sky = status.get('sky', {})
+    position = status.get('position', {})
+
+    gpsd_fix_mode.set(tpv.get('mode'))
+    gpsd_fix_status.set(tpv.get('status'))
+    gpsd_fixes.update([({'mode': mode}, count) for mode, count in status.get('fixes', {}).items()])
+    gpsd_reports.set(status.get('reports'))
+
+    gpsd_satellites_visible.set(sky.get('visible'))
+    gpsd_satellites_used.set(sky.get('used'))
+    gpsd_snr.update([
+        ({'stat': 'mean'}, sky.get('snr_mean')),
+        ({'stat': 'max'}, sky.get('snr_max'))
+    ])
+    gpsd_dop.update([({'type': key}, sky.get(key)) for key in ['hdop', 'vdop', 'pdop']])
+
+    gpsd_error.update([
+        ({'axis': 'time'}, tpv.get('ept')),
+        ({'axis': 'longitude'}, tpv.get('epx')),
+        ({'axis': 'latitude'}, tpv.get('epy')),
+        ({'axis': 'altitude'}, tpv.get('epv'))
+    ])
+
+    axes = {
+        'latitude': 'lat',
+        'longitude': 'lon',
+        'altitude': 'alt'
+    }
+
+    gpsd_position.update([({'axis': axis}, tpv.get(key)) for axis, key in axes.items()])
+    gpsd_position_mean.update([({'axis': axis}, position.get(axis, {}).get('mean')) for axis in axes])
+    gpsd_position_stddev.update([
+        ({'axis': axis}, position.get(axis, {}).get('stddev') if position.get(axis, {}).get('samples') else None)
+        for axis in axes
+    ])
+
+
+def update_ptp(status: dict | None):
+    if not status:
+        ptp_up.set(0)
+
+        for family in [ptp_master_offset, ptp_path_delay, ptp_steps_removed, ptp_grandmaster_info, ptp_port_state]:
+            family.clear()
+
+        return
+
+    ptp_up.set(1)
+
+    offset = status.get('master_offset')
+    delay = status.get('path_delay')
+
+    ptp_master_offset.set(None if offset is None else offset * 1e-9)
+    ptp_path_delay.set(None if delay is None else delay * 1e-9)
+    ptp_steps_removed.set(status.get('steps_removed'))
+
+    if 'gm_identity' in status:
+        ptp_grandmaster_info.set(1,
+                                 identity=status['gm_identity'],
+                                 clock_class=status.get('gm_clock_class'))
+
+    ptp_port_state.update([
+        ({'port': identity, 'state': port['state']}, 1)
+        for identity, port in status.get('ports', {}).items()
+    ])
@@ -0,0 +1,270 @@
+import logging
+import os
+import select
+import socket
+import struct
+import time
+
+from time_sync import metrics
+
+PTP4L_UDS_ADDRESS = '/run/ptp4l'
+UPDATE_INTERVAL = 1.0  # [s]
+RECONNECT_INTERVAL = 5.0  # [s]
+RESPONSE_TIMEOUT = 0.2  # [s]
+
+# IEEE 1588-2008, Table 19 & 38
+MESSAGE_TYPE_MANAGEMENT = 0xd
+CONTROL_FIELD_MANAGEMENT = 0x04
+ACTION_GET = 0
+ACTION_RESPONSE = 2
+TLV_MANAGEMENT = 0x0001
+TLV_MANAGEMENT_ERROR_STATUS = 0x0002
+
+# IEEE 1588-2008, Table 40
+MID_DEFAULT_DATA_SET = 0x2000
+MID_CURRENT_DATA_SET = 0x2001
+MID_PARENT_DATA_SET = 0x2002
+MID_PORT_DATA_SET = 0x2004
+
+# IEEE 1588-2008, Table 8
+PORT_STATES = {
+    1: 'initializing',
+    2: 'faulty',
+    3: 'disabled',
+    4: 'listening',
+    5: 'pre_master',
+    6: 'master',
+    7: 'passive',
+    8: 'uncalibrated',
+    9: 'slave'
+}
+
+# Common message header (34 bytes) followed by the management
+# message fields (14 bytes) and a management TLV header (6 bytes)
+MESSAGE = struct.Struct('>BBHBBH8sI10sHBb10sBBBxHHH')
+RESPONSE = struct.Struct('>B33x10sBBBx')
+TLV = struct.Struct('>HHH')
+
+# IEEE 1588-2008, Table 71: the managementErrorId precedes the managementId
+ERROR_TLV = struct.Struct('>HHHH4x')
+
+DEFAULT_DATA_SET = struct.Struct('>BxH')
+CURRENT_DATA_SET = struct.Struct('>Hqq')
+PARENT_DATA_SET = struct.Struct('>10sBxHiBBBHB8s')
+PORT_DATA_SET = struct.Struct('>10sBbqbBbBbB')
+
+WILDCARD_PORT_IDENTITY = b'\xff' * 10
+
+
+def format_clock_identity(identity: bytes) -> str:
+    """ Formats a clock identity like ptp4l does (e.g. 001122.fffe.334455) """
+    digits = identity.hex()
+    return f'{digits[0:6]}.{digits[6:10]}.{digits[10:16]}'
+
+
+def format_port_identity(identity: bytes) -> str:
+    return f'{format_clock_identity(identity[:8])}-{int.from_bytes(identity[8:], "big")}'
+
+
+def scaled_ns(value: int) -> float:
+    """ Converts a IEEE 1588 TimeInterval to nanoseconds """
+    return value / 65536.0
+
+
+class PtpManagementClient:
+    """ Queries ptp4l via its UNIX domain socket management interface.
+
+        This is the same interface used by linuxptp's pmc tool. Requests are
+        sent as IEEE 1588 management messages over a single persistent
+        datagram socket so that polling does not require a subprocess. """
+
+    def __init__(self, address: str = PTP4L_UDS_ADDRESS, domain: int = 0):
+        self.address = address
+        self.domain = domain
+        self.sequence = 0
+        self.number_ports = None
+
+        self.local_address = f'/run/time-sync-status.{os.getpid()}'
+        self.port_identity = bytes(8) + struct.pack('>H', os.getpid() & 0xffff)
+
+        self.sock = None
+
+    def connect(self):
+        self.close()
+
+        try:
+            os.unlink(self.local_address)
+        except FileNotFoundError:
+            pass
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.local_address)
+        self.sock.connect(self.address)
+
+        # Required to know how many port dataset responses to wait for
+        for data in self.get(MID_DEFAULT_DATA_SET):
+            _, self.number_ports = DEFAULT_DATA_SET.unpack_from(data)
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+
+            try:
+                os.unlink(self.local_address)
+            except FileNotFoundError:
+                pass
+
+        self.sock = None
+
+    def request(self, mid: int) -> int:
+        self.sequence = (self.sequence + 1) & 0xffff
+
+        msg = MESSAGE.pack(
+            MESSAGE_TYPE_MANAGEMENT,
+            2,  # versionPTP
+            MESSAGE.size,
+            self.domain,
+            0,  # reserved
+            0,  # flagField
+            bytes(8),  # correctionField
+            0,  # reserved
+            self.port_identity,
+            self.sequence,
+            CONTROL_FIELD_MANAGEMENT,
+            0x7f,  # logMessageInterval
+            WILDCARD_PORT_IDENTITY,
+            0,  # startingBoundaryHops
+            0,  # boundaryHops
+            ACTION_GET,
+            TLV_MANAGEMENT,
+            2,  # lengthField
+            mid
+        )
+
+        self.sock.send(msg)
+
+        return self.sequence
+
+    def receive(self, sequence: int, mid: int) -> list[bytes]:
+        """ Collects the responses for a request.
+
+            ptp4l sends one response per port for port-specific datasets,
+            so we gather responses until all ports have answered. """
+
+        responses = []
+        deadline = time.monotonic() + RESPONSE_TIMEOUT
+
+        while True:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+
+            ready, _, _ = select.select([self.sock], [], [], timeout)
+            if not ready:
+                break
+
+            buf = self.sock.recv(1500)
+            if len(buf) < MESSAGE.size:
+                continue
+
+            fields = MESSAGE.unpack_from(buf)
+            if fields[0] & 0xf != MESSAGE_TYPE_MANAGEMENT or fields[9] != sequence:
+                continue
+
+            _, _, _, _, action = RESPONSE.unpack_from(buf)
+            if action & 0xf != ACTION_RESPONSE:
+                continue
+
+            tlv_type, _, tlv_id = TLV.unpack_from(buf, RESPONSE.size)
+            if tlv_type == TLV_MANAGEMENT_ERROR_STATUS:
+                if len(buf) < RESPONSE.size + ERROR_TLV.size:
+                    continue
+
+                _, _, error_id, tlv_id = ERROR_TLV.unpack_from(buf, RESPONSE.size)
+                if tlv_id == mid:
+                    raise RuntimeError(f'ptp4l rejected management request 0x{mid:04x} with error 0x{error_id:04x}')
+
+                continue
+
+            if tlv_id != mid:
+                continue
+
+            responses.append(buf[MESSAGE.size:])
+
+            # Only the port dataset is answered by multiple ports
+            if mid != MID_PORT_DATA_SET or len(responses) == self.number_ports:
+                break
+
+        return responses
+
+    def get(self, mid: int) -> list[bytes]:
+        return self.receive(self.request(mid), mid)
+
+    def get_status(self) -> dict:
+        status = {}
+
+        for data in self.get(MID_CURRENT_DATA_SET):
+            steps_removed, offset, delay = CURRENT_DATA_SET.unpack_from(data)
+            status.update({
+                'steps_removed': steps_removed,
+                'master_offset': scaled_ns(offset),
+                'path_delay': scaled_ns(delay)
+            })
+
+        for data in self.get(MID_PARENT_DATA_SET):
+            parent, _, _, _, gm_prio1, gm_class, gm_accuracy, gm_variance, gm_prio2, gm_identity = PARENT_DATA_SET.unpack_from(data)
+            status.update({
+                'parent_port_identity': format_port_identity(parent),
+                'gm_identity': format_clock_identity(gm_identity),
+                'gm_priority1': gm_prio1,
+                'gm_priority2': gm_prio2,
+                'gm_clock_class': gm_class,
+                'gm_clock_accuracy': gm_accuracy,
+                'gm_offset_scaled_log_variance': gm_variance
+            })
+
+        ports = {}
+        for data in self.get(MID_PORT_DATA_SET):
+            identity, state, _, peer_delay, *_ = PORT_DATA_SET.unpack_from(data)
+            ports[format_port_identity(identity)] = {
+                'state': PORT_STATES.get(state, 'unknown'),
+                'peer_path_delay': scaled_ns(peer_delay)
+            }
+
+        status['ports'] = ports
+
+        # Summarize the state of the most relevant port
+        states = [port['state'] for port in ports.values()]
+        for state in ['slave', 'uncalibrated', 'master', 'passive', 'listening']:
+            if state in states:
+                status['port_state'] = state
+                break
+        else:
+            status['port_state'] = states[0] if states else 'unknown'
+
+        return status
+
+
+def update_status_ptp(status: dict, config: dict):
+    client = PtpManagementClient(domain=config.get('domainNumber', 0))
+
+    while True:
+        try:
+            client.connect()
+
+            while True:
+                status['ptp'] = client.get_status()
+                metrics.update_ptp(status['ptp'])
+
+                logging.debug('Received update from ptp4l: %s', status['ptp'])
+
+                time.sleep(UPDATE_INTERVAL)
+        except Exception as e:
+            logging.error('Failed to query ptp4l status: %s. Retrying in %d sec', e, RECONNECT_INTERVAL)
+
+            status['ptp'] = None
+            metrics.update_ptp(None)
+        finally:
+            client.close()
+
+        time.sleep(RECONNECT_INTERVAL)
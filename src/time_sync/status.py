@@ -10,7 +10,10 @@ import kubernetes
 from datetime import datetime
 from http.client import responses
 from tornado import ioloop, web
-from gpsdclient import GPSDClient
+
+from time_sync import metrics
+from time_sync.gpsd import update_status_gpsd
+from time_sync.ptp import update_status_ptp
 
 API_PREFIX = '/api/v1'
 UPDATE_INTERVAL = 10.0
@@ -51,6 +54,13 @@ class ConfigHandler(BaseRequestHandler):
             raise web.HTTPError(500, 'failed to get config')
 
 
+class MetricsHandler(BaseRequestHandler):
+
+    def get(self):
+        self.set_header('Content-Type', metrics.CONTENT_TYPE)
+        self.write(metrics.render())
+
+
 class SyncedHandler(BaseRequestHandler):
 
     def get(self):
@@ -96,6 +106,7 @@ def patch_node_status(v1, status: dict):
 def patch_node(v1, status: dict):
     gpsd_status = status.get('gpsd')
     chrony_status = status.get('chrony')
+    ptp_status = status.get('ptp')
 
     annotations = {}
 
@@ -137,6 +148,14 @@ def patch_node(v1, status: dict):
                 'last-gps-time': tpv.get('time')
             })
 
+    if ptp_status:
+        annotations.update({
+            'ptp-port-state': ptp_status.get('port_state'),
+            'ptp-master-offset': ptp_status.get('master_offset'),
+            'ptp-path-delay': ptp_status.get('path_delay'),
+            'ptp-gm-identity': ptp_status.get('gm_identity')
+        })
+
     patch = {
         'metadata': {
             'annotations': {
@@ -227,25 +246,13 @@ def is_synced(status: dict) -> bool:
     if chrony_status is None:
         return None
 
-    for _, source in status.get('sources', {}).items():
+    for _, source in chrony_status.get('sources', {}).items():
         if source.get('state', 'unknown') == 'synced':
             return True
 
     return False
 
 
-def update_status_gpsd(status: dict):
-    status['gpsd'] = {}
-
-    while True:
-        client = GPSDClient()
-        for result in client.dict_stream(convert_datetime=True):
-            cls = result['class'].lower()
-            status['gpsd'][cls] = result
-
-            logging.info('Received update from GPSd: %s', result)
-
-
 def update_status(v1, status: dict):
     while True:
         try:
@@ -257,6 +264,10 @@ def update_status(v1, status: dict):
             logging.error('Failed to query chrony status: %s', e)
 
             status['chrony'] = None
+            status['synced'] = None
+
+        metrics.update_chrony(status['chrony'])
+        metrics.update_synced(status['synced'])
 
         try:
             patch_node_status(v1, status)
@@ -306,6 +317,11 @@ def main():
         t2 = threading.Thread(target=update_status_gpsd, args=(status,))
         t2.start()
 
+    ptp_config = config.get('ptp')
+    if ptp_config and ptp_config.get('enabled'):
+        t3 = threading.Thread(target=update_status_ptp, args=(status, ptp_config))
+        t3.start()
+
     args = {
         'status': status,
         'config': config,
@@ -315,6 +331,7 @@ def main():
         (API_PREFIX + r"/status", StatusHandler, args),
         (API_PREFIX + r"/status/synced", SyncedHandler, args),
         (API_PREFIX + r"/config", ConfigHandler, args),
+        (r"/metrics", MetricsHandler, args),
     ])
 
     while True: